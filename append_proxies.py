@@ -1,56 +1,52 @@
-import json
+import argparse
+import glob
 import os
 import shutil
 import sys
 from datetime import datetime
 
-import yaml
+from fingerprint import diff_proxies, ensure_unique_names, merge_fingerprint, merge_index
+import metrics
+from proxy_node import from_dicts
+from proxy_store import ProxyStore
+from yaml_io import file_signature, load_yaml, save_provider
 
-
-def load_yaml(file_path):
-    try:
-        with open(file_path, "r") as file:
-            return yaml.safe_load(file)
-    except yaml.YAMLError as e:
-        print(f"Error loading YAML file {file_path}: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Unexpected error loading file {file_path}: {e}")
-        sys.exit(1)
-
-
-def save_yaml(file_path, data):
-    try:
-        with open(file_path, "w") as file:
-            yaml.dump(
-                data,
-                file,
-                allow_unicode=True,
-                sort_keys=False,
-                default_flow_style=False,
-                indent=2,
-            )
-    except Exception as e:
-        print(f"Error saving YAML file {file_path}: {e}")
-        sys.exit(1)
+# store_meta key of the provider file signature at the last sync with it
+PROVIDER_SIGNATURE = "provider_signature"
 
 
 def merge_proxies(new_proxies, old_proxies):
-    try:
-        # Check if both new_proxies and old_proxies have the 'proxies' key
-        if "proxies" not in new_proxies or "proxies" not in old_proxies:
-            raise ValueError("Both YAML files must contain a 'proxies' key")
-
-        # Create a dictionary to store proxies with keys as proxy names
-        merged_proxies = {proxy["name"]                          : proxy for proxy in old_proxies["proxies"]}
-        new_proxies_added = False
+    return merge_many_proxies([new_proxies], old_proxies)
 
-        for proxy in new_proxies["proxies"]:
-            if proxy["name"] not in merged_proxies:
-                new_proxies_added = True
-            merged_proxies[proxy["name"]] = proxy
 
-        return {"proxies": list(merged_proxies.values())}, new_proxies_added
+def merge_many_proxies(new_configs, old_proxies):
+    # merge_proxies over several new files at once: the fingerprint index is
+    # built a single time and later files win over earlier ones. Distinct
+    # proxies that share a name are all kept, with unique names; a proxy
+    # that only moved to another CDN front replaces its old entry.
+    try:
+        # Check if every file has the 'proxies' key
+        if "proxies" not in old_proxies or any(
+            "proxies" not in new_proxies for new_proxies in new_configs
+        ):
+            raise ValueError("All YAML files must contain a 'proxies' key")
+
+        with metrics.timer("merge"):
+            # Create a dictionary to store proxies keyed by fingerprint
+            merged_proxies = merge_index(old_proxies["proxies"])
+            added = 0
+
+            for new_proxies in new_configs:
+                for proxy in new_proxies["proxies"]:
+                    fingerprint = merge_fingerprint(proxy)
+                    if fingerprint not in merged_proxies:
+                        added += 1
+                    merged_proxies[fingerprint] = proxy
+
+            merged = ensure_unique_names(merged_proxies.values())
+        metrics.count("merge_added", added)
+        metrics.count("merge_total", len(merged))
+        return {"proxies": merged}, added > 0
     except KeyError as e:
         print(f"Key error during merge: {e}")
         sys.exit(1)
@@ -63,20 +59,16 @@ def merge_proxies(new_proxies, old_proxies):
 
 
 def compare_proxies(new_config, existing_config, print_proxies=False):
-    new_proxies = {json.dumps(proxy, sort_keys=True)
-                   for proxy in new_config["proxies"]}
-    existing_proxies = {
-        json.dumps(proxy, sort_keys=True) for proxy in existing_config["proxies"]
-    }
-
-    added_proxies = new_proxies - existing_proxies
-    if added_proxies:
+    diff = diff_proxies(new_config["proxies"], existing_config["proxies"])
+    if any(diff.values()):
         if print_proxies:
             print("New proxies found:")
-            for proxy in added_proxies:
-                print(f"\n{json.loads(proxy)}")
+            for proxy in diff["added"] + diff["changed"]:
+                print(f"\n{proxy}")
 
-        print(f"Total number of new proxies: {len(added_proxies)}")
+        print(
+            f"Total number of new proxies: {len(diff['added'])}, "
+            f"changed: {len(diff['changed'])}, removed: {len(diff['removed'])}")
         return True
 
     print("No update available")
@@ -91,13 +83,42 @@ def backup_file(file_path):
         print(f"Backup created at {backup_path}")
 
 
-def main(new_proxies_path, old_proxies_path):
-    # Load the YAML files
-    new_proxies = load_yaml(new_proxies_path)
+def expand_paths(patterns):
+    # Accept both shell-expanded file lists and quoted glob patterns
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            paths.extend(matches)
+        else:
+            print(f"Skipping {pattern}: no such file")
+    return paths
+
+
+def load_new_configs(new_proxies_paths):
+    new_configs = []
+    for path in new_proxies_paths:
+        data = load_yaml(path)
+        if data and data.get("proxies"):
+            data["proxies"] = from_dicts(data["proxies"])
+            new_configs.append(data)
+        else:
+            print(f"Skipping {path}: no proxies found")
+    return new_configs
+
+
+def main(new_proxies_paths, old_proxies_path):
+    if isinstance(new_proxies_paths, str):
+        new_proxies_paths = [new_proxies_paths]
+
+    # Load the YAML files, the destination only once
+    new_configs = load_new_configs(new_proxies_paths)
     old_proxies = load_yaml(old_proxies_path)
+    if old_proxies and old_proxies.get("proxies"):
+        old_proxies["proxies"] = from_dicts(old_proxies["proxies"])
 
     # Merge proxies and get the result
-    merged_proxies, new_proxies_added = merge_proxies(new_proxies, old_proxies)
+    merged_proxies, new_proxies_added = merge_many_proxies(new_configs, old_proxies)
 
     if new_proxies_added:
         # Compare proxies and print new ones if any
@@ -106,20 +127,90 @@ def main(new_proxies_path, old_proxies_path):
             backup_file(old_proxies_path)
 
         # Save the merged proxies to the old proxies file
-        save_yaml(old_proxies_path, merged_proxies)
+        save_provider(old_proxies_path, merged_proxies)
 
         print(
-            f"Proxies from {new_proxies_path} have been merged into {old_proxies_path} without duplicates.\n"
+            f"Proxies from {', '.join(new_proxies_paths)} have been merged into {old_proxies_path} without duplicates.\n"
         )
     else:
         print("No new proxies to merge. The existing file remains unchanged.\n")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python append_proxies.py <new_proxies.yaml> <old_proxies.yaml>")
-        sys.exit(1)
+def main_store(new_proxies_paths, old_proxies_path, store_path):
+    # Merge through the persistent store: only new or changed proxies are
+    # written to it, and the provider file is exported only on change. The
+    # provider stays the source of truth for removals, so proxies dropped
+    # from it by clean_proxy_provider are dropped from the store first. The
+    # provider is only read for that when its file signature differs from
+    # the one recorded at the last export.
+    if isinstance(new_proxies_paths, str):
+        new_proxies_paths = [new_proxies_paths]
+    new_configs = load_new_configs(new_proxies_paths)
+
+    with ProxyStore(store_path) as store:
+        if (
+            os.path.exists(old_proxies_path)
+            and file_signature(old_proxies_path) != store.get_meta(PROVIDER_SIGNATURE)
+        ):
+            old_proxies = load_yaml(old_proxies_path) or {}
+            provider_proxies = old_proxies.get("proxies") or []
+            if not len(store):
+                if provider_proxies:
+                    store.merge(provider_proxies)
+                    print(f"Initialised {store_path} from {old_proxies_path}")
+            else:
+                removed = store.retain(provider_proxies)
+                if removed:
+                    print(f"Dropped {removed} proxies no longer in {old_proxies_path}")
+            store.set_meta(PROVIDER_SIGNATURE, file_signature(old_proxies_path))
+
+        added = 0
+        changed = 0
+        for new_proxies in new_configs:
+            file_added, file_changed = store.merge(new_proxies["proxies"])
+            added += file_added
+            changed += file_changed
+        if not added and not changed:
+            print("No new proxies to merge. The existing file remains unchanged.\n")
+            return
+
+        print(f"Total number of new proxies: {added}, changed proxies: {changed}")
+        backup_file(old_proxies_path)
+        save_provider(old_proxies_path, store.export())
+        store.set_meta(PROVIDER_SIGNATURE, file_signature(old_proxies_path))
+
+    print(
+        f"Proxies from {', '.join(new_proxies_paths)} have been merged into {old_proxies_path} without duplicates.\n"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        usage="python append_proxies.py <new_proxies.yaml>... <old_proxies.yaml> [--store proxies.db]",
+        description="Merge one or more proxy files (or glob patterns) into a "
+        "provider file with a single load, backup and write",
+    )
+    parser.add_argument("paths", nargs="+", metavar="path")
+    parser.add_argument(
+        "--store", metavar="DB",
+        help="Merge through a persistent SQLite proxy store")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if len(args.paths) < 2:
+        parser.error("need at least one new proxies file and the destination")
+    return args
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    new_proxies_paths = expand_paths(args.paths[:-1])
+    old_proxies_path = args.paths[-1]
+    if args.store:
+        main_store(new_proxies_paths, old_proxies_path, args.store)
+    else:
+        main(new_proxies_paths, old_proxies_path)
+    metrics.write_reports(args)
 
-    new_proxies_path = sys.argv[1]
-    old_proxies_path = sys.argv[2]
-    main(new_proxies_path, old_proxies_path)
+
+if __name__ == "__main__":
+    cli()
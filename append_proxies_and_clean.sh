@@ -27,18 +27,11 @@ fi
 echo "> Loading environment
 "
 source ./sniffing_tools_env/bin/activate
-echo "> Generating proxy_providers from subcription
+echo "> Generating proxy_providers from subcription, appending them to $1 and cleaning
 "
-python ./v2raysubtoyaml.py
-
-for proxy in ./proxies/*/proxies_updated_80.yaml; do
-	echo "> Appending $proxy to $1
-	"
-	python append_proxies.py "$proxy" "$1"
-done
-
+# One interpreter for every stage; proxies are handed over in memory
 if [ -n "$log_file" ]; then
-	python ./clean_proxy_provider.py "$1" "$log_file"
+	python ./cli.py sync "$1" "$log_file"
 else
-	python ./clean_proxy_provider.py "$1"
+	python ./cli.py sync "$1"
 fi
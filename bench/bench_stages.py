@@ -0,0 +1,363 @@
+import argparse
+import base64
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import metrics  # noqa: E402
+import test_servers  # noqa: E402
+from servers import (  # noqa: E402
+    WS_EXPECTED,
+    WS_PATH,
+    WS_SERVERNAME,
+    listener_fleet,
+    subscription_server,
+    websocket_fleet,
+)
+from synthetic import vmess_subscription, write_mihomo_log  # noqa: E402
+from test_servers import percentile  # noqa: E402
+
+STAGES = [
+    "convert", "fetch", "merge", "log_scan", "log_scan_reversed", "probe", "deep_probe",
+]
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+# Health check lines per provider proxy in the generated mihomo logs
+LOG_LINES_PER_PROXY = 20
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(values):
+    return {
+        "p50": statistics.median(values),
+        "p95": percentile(values, 95),
+        "max": max(values),
+    }
+
+
+def decoded_subscription(nodes):
+    return base64.b64decode(vmess_subscription(nodes)).decode("utf-8")
+
+
+def convert_quietly(decoded_data):
+    import v2raysubtoyaml
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return v2raysubtoyaml.convert_v2ray_to_clash(decoded_data)["proxies"]
+
+
+def prepare(stage, size, options, workdir):
+    # Builds the stage input outside the timed region. Returns (func, items)
+    # where func runs the stage once and items is what throughput counts.
+    if stage == "convert":
+        decoded_data = decoded_subscription(size)
+        return lambda: convert_quietly(decoded_data), size
+
+    if stage == "fetch":
+        import v2raysubtoyaml
+
+        session = v2raysubtoyaml.create_session()
+
+        def fetch():
+            decoded_data, _ = v2raysubtoyaml.fetch_subscription(
+                options["url"], session)
+            return convert_quietly(decoded_data)
+
+        return fetch, size
+
+    if stage == "merge":
+        import append_proxies
+
+        proxies = convert_quietly(decoded_subscription(size))
+        # Half of the new file is already in the provider
+        old = {"proxies": proxies[: size * 3 // 4]}
+        new = {"proxies": proxies[size // 4:]}
+        return lambda: append_proxies.merge_proxies(new, old), len(proxies)
+
+    if stage in ("log_scan", "log_scan_reversed"):
+        import clean_proxy_provider
+
+        names = [f"node-{index}" for index in range(size)]
+        lines = size * LOG_LINES_PER_PROXY
+        log_path = os.path.join(workdir, "mihomo.log")
+        write_mihomo_log(log_path, names, lines)
+        checkpoint = clean_proxy_provider.checkpoint_path(log_path)
+        proxy_names = set(names) if stage == "log_scan_reversed" else None
+
+        def scan():
+            # Without a checkpoint every run is a cold scan of the whole log
+            if os.path.exists(checkpoint):
+                os.remove(checkpoint)
+            return clean_proxy_provider.extract_inactive_proxies(
+                log_path, proxy_names)
+
+        return scan, lines
+
+    if stage == "probe":
+        proxies = [
+            {"name": f"{kind}-{port}", "servername": "127.0.0.1", "port": port, "tls": tls}
+            for port, kind, tls in options["listeners"]
+        ]
+
+        def probe():
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+                return test_servers.check_proxies(
+                    proxies, timeout=options["probe_timeout"], retries=0,
+                    tls=options["tls"])
+
+        return probe, len(proxies)
+
+    if stage == "deep_probe":
+        # Proxies as update_proxy_server leaves them: server is the front
+        # address, servername and the ws Host name the real host
+        proxies = [
+            {
+                "name": f"{kind}-{port}",
+                "server": "127.0.0.1",
+                "servername": WS_SERVERNAME,
+                "port": port,
+                "tls": tls,
+                "network": "ws",
+                "ws-opts": {"path": WS_PATH, "headers": {"Host": WS_SERVERNAME}},
+            }
+            for port, kind, tls in options["ws_listeners"]
+        ]
+
+        def deep_probe():
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+                return test_servers.check_proxies(
+                    proxies, timeout=options["probe_timeout"], retries=0, deep=True)
+
+        return deep_probe, len(proxies)
+
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def run_stage(stage, size, repeat, options):
+    # Runs in a fresh interpreter so peak RSS belongs to this stage alone
+    with tempfile.TemporaryDirectory() as workdir:
+        func, items = prepare(stage, size, options, workdir)
+        input_rss = peak_rss_mb()
+        metrics.default_metrics.reset()
+        timings = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+
+    report = {
+        "stage": stage,
+        "size": size,
+        "items": items,
+        "repeat": repeat,
+        "seconds": summarize(timings),
+        "throughput": items / statistics.median(timings),
+        "input_rss_mb": input_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "breakdown": metrics.default_metrics.report()["stages"],
+    }
+    if stage == "probe":
+        latencies = [r["latency"] for r in result if r["latency"] is not None]
+        report["reachable"] = len(latencies)
+        if latencies:
+            report["probe_latency_ms"] = summarize(latencies)
+        tls_latencies = [r["tls_latency"] for r in result if r["tls_latency"] is not None]
+        if tls_latencies:
+            report["tls_latency_ms"] = summarize(tls_latencies)
+    if stage == "deep_probe":
+        report["reachable"] = sum(r["status"] == "ok" for r in result)
+        # A stand-in whose status differs from WS_EXPECTED is a probe bug
+        kinds = {p["port"]: p["name"].split("-")[0] for p in (r["proxy"] for r in result)}
+        report["misclassified"] = sorted(
+            f"{kinds[r['proxy']['port']]}: {r['status']}"
+            for r in result
+            if r["proxy"]["tls"] and r["status"] != WS_EXPECTED[kinds[r["proxy"]["port"]]]
+        )
+    return report
+
+
+def spawn_stage(stage, size, repeat, options):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stage, stage, size, repeat, options).result()
+
+
+def run_benchmarks(args):
+    results = []
+    for stage in args.stages:
+        for size in args.sizes:
+            options = {}
+            with contextlib.ExitStack() as stack:
+                if stage == "fetch":
+                    body = vmess_subscription(size)
+                    base_url = stack.enter_context(subscription_server(body))
+                    options["url"] = f"{base_url}/sub.txt"
+                if stage == "probe":
+                    # The probe fleet size is fixed by --live/--slow/...,
+                    # not by the subscription sizes
+                    if results and results[-1]["stage"] == "probe":
+                        continue
+                    options["listeners"] = stack.enter_context(listener_fleet(
+                        args.live, args.slow, args.blackhole, args.dead,
+                        args.slow_delay, args.tls))
+                    options["probe_timeout"] = args.probe_timeout
+                    options["tls"] = args.tls
+                    size = len(options["listeners"])
+                if stage == "deep_probe":
+                    if results and results[-1]["stage"] == "deep_probe":
+                        continue
+                    options["ws_listeners"] = stack.enter_context(websocket_fleet(
+                        {kind: args.ws_per_kind for kind in WS_EXPECTED}))
+                    options["probe_timeout"] = args.deep_timeout
+                    size = len(options["ws_listeners"])
+                result = spawn_stage(stage, size, args.repeat, options)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_result(result):
+    line = (
+        f"{result['stage']:>18} {result['size']:>7}: "
+        f"{result['throughput']:12.0f} items/s  "
+        f"p50 {result['seconds']['p50'] * 1000:9.1f}ms  "
+        f"p95 {result['seconds']['p95'] * 1000:9.1f}ms  "
+        f"peak RSS {result['peak_rss_mb']:7.1f}MB"
+    )
+    if "reachable" in result:
+        line += f"  reachable {result['reachable']}/{result['items']}"
+    if result.get("misclassified"):
+        line += f"  misclassified {', '.join(result['misclassified'])}"
+    print(line, flush=True)
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+
+def results_path(revision):
+    if os.path.exists(revision):
+        return revision
+    return os.path.join(RESULTS_DIR, f"{revision}.json")
+
+
+def save_results(results, revision):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    file_path = results_path(revision)
+    with open(file_path, "w") as file:
+        json.dump(
+            {"revision": revision, "time": time.time(), "results": results},
+            file,
+            indent=2,
+        )
+    print(f"Results have been written to {file_path}")
+
+
+def compare_results(results, baseline_revision):
+    # Throughput and peak RSS relative to a stored run
+    file_path = results_path(baseline_revision)
+    try:
+        with open(file_path, "r") as file:
+            baseline = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Cannot read baseline {file_path}: {e}")
+        return
+    previous = {(r["stage"], r["size"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline['revision']}:")
+    for result in results:
+        before = previous.get((result["stage"], result["size"]))
+        if before is None:
+            continue
+        print(
+            f"{result['stage']:>18} {result['size']:>7}: "
+            f"throughput {result['throughput'] / before['throughput']:6.2f}x  "
+            f"peak RSS {result['peak_rss_mb'] - before['peak_rss_mb']:+8.1f}MB"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Throughput, latency percentiles and peak RSS of each "
+        "pipeline stage on synthetic inputs, stored per commit"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES,
+        help="Stages to run")
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[1000, 10000],
+        help="Subscription sizes in nodes (the log stages use size proxies)")
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="Timed runs per stage and size")
+    parser.add_argument("--live", type=int, default=400, help="Listening probe targets")
+    parser.add_argument(
+        "--slow", type=int, default=50,
+        help="Targets that delay the TLS handshake")
+    parser.add_argument(
+        "--blackhole", type=int, default=25,
+        help="Targets whose TCP handshake never completes")
+    parser.add_argument("--dead", type=int, default=25, help="Targets refusing connections")
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    parser.add_argument("--probe-timeout", type=float, default=1.0)
+    parser.add_argument(
+        "--tls", action="store_true",
+        help="Also measure TLS handshakes in the probe stage")
+    parser.add_argument(
+        "--ws-per-kind", type=int, default=10,
+        help="WebSocket stand-ins of each kind for the deep_probe stage")
+    parser.add_argument(
+        "--deep-timeout", type=float, default=5.0,
+        help="Seconds per step in the deep_probe stage; silent stand-ins "
+        "take this long, and every handshake runs in this process")
+    parser.add_argument(
+        "--revision",
+        help="Name to store the results under (default: the git commit)")
+    parser.add_argument(
+        "--compare", metavar="REVISION",
+        help="Print the change against a stored run (commit or file path)")
+    parser.add_argument(
+        "--no-save", action="store_true",
+        help="Do not store the results")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    revision = args.revision or git_revision()
+    print(f"Benchmarking {revision}")
+    results = run_benchmarks(args)
+    if not args.no_save:
+        save_results(results, revision)
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HOST = "127.0.0.1"
+
+# What the WebSocket stand-ins expect as SNI, Host header and path
+WS_SERVERNAME = "cdn.example.com"
+WS_PATH = "/ws"
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+# Status the deep probe should report for each WebSocket stand-in kind
+WS_EXPECTED = {
+    "ws": "ok",
+    "forbidden": "rejected",
+    "silent": "timeout",
+    "bad_accept": "bad_response",
+    "plain": "tls_failed",
+    "wrong_sni": "tls_failed",
+    "dead": "unreachable",
+}
+
+
+@contextmanager
+def subscription_server(body):
+    # Serves body at every path, like a subscription host. Yields the base
+    # url.
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((HOST, 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{HOST}:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def self_signed_context():
+    # Server-side TLS context with a throwaway certificate, or None when the
+    # openssl binary is not available
+    if shutil.which("openssl") is None:
+        yield None
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        cert, key = f"{folder}/cert.pem", f"{folder}/key.pem"
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "ec",
+                "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+                "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        yield context
+
+
+def blackhole_listener():
+    # A listening socket whose accept queue is full, so new SYNs are dropped
+    # and connects hang until the client gives up
+    listener = socket.socket()
+    listener.bind((HOST, 0))
+    listener.listen(0)
+    fillers = []
+    while True:
+        filler = socket.socket()
+        filler.settimeout(0.2)
+        try:
+            filler.connect(listener.getsockname())
+        except OSError:
+            filler.close()
+            break
+        fillers.append(filler)
+    return listener, fillers
+
+
+def dead_port():
+    # A port nothing listens on, so connects are refused
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def listener_fleet(live=100, slow=0, blackhole=0, dead=0, slow_delay=0.5, tls=True):
+    # Local stand-ins for proxy servers. live and slow listeners accept and
+    # speak TLS when a certificate could be made; slow ones wait slow_delay
+    # before the handshake. blackhole ones never complete the TCP handshake
+    # and dead ones refuse it. Yields a list of (port, kind, tls).
+    # Probes hang up mid-handshake all the time, which asyncio would log
+    logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    sockets = []
+    servers = []
+    listeners = []
+
+    with self_signed_context() if tls else nullcontext() as context:
+
+        def handler(delay):
+            async def handle(reader, writer):
+                try:
+                    if delay:
+                        await asyncio.sleep(delay)
+                    if context is not None:
+                        await writer.start_tls(context)
+                    await reader.read(1)
+                except (OSError, ssl.SSLError, ConnectionError):
+                    pass
+                finally:
+                    writer.close()
+
+            return handle
+
+        async def start(count, delay, kind):
+            for _ in range(count):
+                server = await asyncio.start_server(handler(delay), HOST, 0)
+                servers.append(server)
+                port = server.sockets[0].getsockname()[1]
+                listeners.append((port, kind, context is not None))
+
+        try:
+            asyncio.run_coroutine_threadsafe(start(live, 0, "live"), loop).result()
+            asyncio.run_coroutine_threadsafe(
+                start(slow, slow_delay, "slow"), loop).result()
+            for _ in range(blackhole):
+                listener, fillers = blackhole_listener()
+                sockets.append(listener)
+                sockets.extend(fillers)
+                listeners.append((listener.getsockname()[1], "blackhole", False))
+            for _ in range(dead):
+                listeners.append((dead_port(), "dead", False))
+            yield listeners
+        finally:
+            for server in servers:
+                loop.call_soon_threadsafe(server.close)
+            for sock in sockets:
+                sock.close()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+async def serve_websocket(reader, writer, kind):
+    # Answers one WebSocket upgrade the way the kind says. A real upgrade
+    # needs WS_PATH and a Host of WS_SERVERNAME, anything else gets a 404.
+    try:
+        if kind == "plain":
+            # Not TLS at all: whatever arrives gets an HTTP error
+            await reader.read(1024)
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        if kind == "silent":
+            await reader.read(1)
+            return
+
+        lines = head.split("\r\n")
+        path = lines[0].split(" ")[1] if len(lines[0].split(" ")) > 1 else ""
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if kind == "forbidden":
+            response = "HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n"
+        elif path != WS_PATH or headers.get("host") != WS_SERVERNAME:
+            response = "HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+        else:
+            key = headers.get("sec-websocket-key", "")
+            accept = base64.b64encode(
+                hashlib.sha1(key.encode("ascii") + WS_GUID).digest()).decode("ascii")
+            if kind == "bad_accept":
+                accept = accept[::-1]
+            response = (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            )
+        writer.write(response.encode("latin-1"))
+        await writer.drain()
+    except (OSError, ssl.SSLError, ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+@contextmanager
+def websocket_fleet(counts=None):
+    # Local stand-ins for CDN-fronted vmess+ws+tls servers, counts[kind] of
+    # each kind in WS_EXPECTED. TLS kinds use a self-signed certificate and
+    # abort the handshake unless the SNI is WS_SERVERNAME; wrong_sni ones
+    # only accept another name. Without openssl every listener is plain
+    # and tls is False. Yields a list of (port, kind, tls).
+    counts = counts or {kind: 1 for kind in WS_EXPECTED}
+    logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+    listeners = []
+
+    with self_signed_context() as context, self_signed_context() as other_context:
+
+        def require_sni(expected):
+            def check(ssl_object, server_name, ssl_context):
+                if server_name != expected:
+                    return ssl.ALERT_DESCRIPTION_UNRECOGNIZED_NAME
+                return None
+
+            return check
+
+        if context is not None:
+            context.sni_callback = require_sni(WS_SERVERNAME)
+            other_context.sni_callback = require_sni("other.example.com")
+
+        async def start():
+            for kind, count in counts.items():
+                if kind == "dead":
+                    listeners.extend((dead_port(), kind, context is not None) for _ in range(count))
+                    continue
+                server_context = context
+                if kind == "plain":
+                    server_context = None
+                elif kind == "wrong_sni":
+                    server_context = other_context
+                for _ in range(count):
+                    server = await asyncio.start_server(
+                        lambda r, w, kind=kind: serve_websocket(r, w, kind),
+                        HOST, 0, ssl=server_context)
+                    servers.append(server)
+                    port = server.sockets[0].getsockname()[1]
+                    listeners.append((port, kind, context is not None))
+
+        try:
+            asyncio.run_coroutine_threadsafe(start(), loop).result()
+            yield listeners
+        finally:
+            for server in servers:
+                loop.call_soon_threadsafe(server.close)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
@@ -0,0 +1,77 @@
+import base64
+import json
+import random
+
+NETWORKS = ["ws", "ws", "ws", "tcp", "grpc"]
+PORTS = [80, 443, 443, 8080, "2052", "8443"]
+
+
+def vmess_payload(index, rng):
+    host = f"cdn{index % 37}.example{index % 5}.com"
+    return {
+        "v": "2",
+        "ps": f"🇺🇸 node-{index}",
+        "add": f"srv{index % 500}.example.net",
+        "port": rng.choice(PORTS),
+        "id": f"{index:08x}-1111-2222-3333-444455556666",
+        "aid": rng.choice([0, "0"]),
+        "scy": "auto",
+        "net": rng.choice(NETWORKS),
+        "type": "none",
+        "host": host,
+        "path": f"/ws{index % 11}",
+        "tls": rng.choice(["tls", ""]),
+        "sni": host,
+    }
+
+
+def vmess_link(index, rng, malformed_ratio=0.01, non_utf8_ratio=0.01):
+    payload = json.dumps(vmess_payload(index, rng), ensure_ascii=False)
+    roll = rng.random()
+    if roll < malformed_ratio:
+        # Trailing garbage and a broken value, only salvageable by regex
+        raw = (payload[:-1] + ', "port": 44 3,}').encode("utf-8")
+    elif roll < malformed_ratio + non_utf8_ratio:
+        raw = payload.replace("🇺🇸", "Привет").encode("cp1251")
+    else:
+        raw = payload.encode("utf-8")
+    return "vmess://" + base64.b64encode(raw).decode("ascii")
+
+
+def vmess_subscription(count, seed=0, malformed_ratio=0.01, non_utf8_ratio=0.01):
+    # Base64 subscription body with count vmess links, in the same shape
+    # as the public feeds v2raysubtoyaml.py consumes
+    rng = random.Random(seed)
+    links = "\n".join(
+        vmess_link(index, rng, malformed_ratio, non_utf8_ratio)
+        for index in range(count)
+    )
+    return base64.b64encode(links.encode("utf-8"))
+
+
+def mihomo_log(proxy_names, lines, seed=0, dead_ratio=0.2, noise_ratio=0.5):
+    # mihomo debug log lines: health checks for proxy_names (dead_ratio of
+    # them failing) mixed with noise_ratio connection lines the scanner has
+    # to skip
+    rng = random.Random(seed)
+    dead = set(rng.sample(proxy_names, int(len(proxy_names) * dead_ratio)))
+    for index in range(lines):
+        timestamp = f"2026-01-01T{index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d}Z"
+        name = rng.choice(proxy_names)
+        if rng.random() < noise_ratio:
+            yield (
+                f'time="{timestamp}" level=debug msg="[TCP] 127.0.0.1:{40000 + index % 20000} '
+                f'--> example{index % 97}.com:443 match Match using {name}"\n'
+            )
+            continue
+        alive = "false" if name in dead and rng.random() < 0.9 else "true"
+        yield (
+            f'time="{timestamp}" level=debug msg="[Provider] proxy: {name}, '
+            f"url: http://cp.cloudflare.com, alive: {alive}, delay: {rng.randint(50, 900)}, "
+            f'uid: {{{index:08x}-0000}}"\n'
+        )
+
+
+def write_mihomo_log(file_path, proxy_names, lines, seed=0, **kwargs):
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.writelines(mihomo_log(proxy_names, lines, seed, **kwargs))
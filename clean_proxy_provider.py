@@ -1,78 +1,213 @@
+import argparse
+import json
+import mmap
+import os
 import re
-import sys
+from datetime import datetime
 
-import yaml
+import metrics
+from health_store import MIN_SCORE, HealthStore
+from proxy_node import from_dicts, proxy_host, proxy_path
+from yaml_io import atomic_write, load_yaml, save_provider
 
+UID_PATTERN = re.compile(r"uid: \{(.*?)\}")
+ALIVE_PATTERN = re.compile(r"alive: (true|false)")
+TIME_PATTERN = re.compile(r'time="([^"]+)"')
+DELAY_PATTERN = re.compile(r"delay: (\d+)")
 
-def load_yaml(file_path):
-    try:
-        with open(file_path, "r") as file:
-            return yaml.safe_load(file)
-    except yaml.YAMLError as e:
-        print(f"Error loading YAML file {file_path}: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Unexpected error loading file {file_path}: {e}")
-        sys.exit(1)
-
-
-def save_yaml(file_path, data):
-    if data and "proxies" in data and data["proxies"]:
-        try:
-            with open(file_path, "w") as file:
-                yaml.dump(
-                    data,
-                    file,
-                    allow_unicode=True,
-                    sort_keys=False,
-                    default_flow_style=False,
-                    indent=2,
-                )
-                print(f"Configuration has been written to {file_path}")
-        except Exception as e:
-            print(f"Error saving YAML file {file_path}: {e}")
-            sys.exit(1)
-    else:
-        print(f"No valid data to save to {file_path}")
+# Byte offset, inode and per-proxy verdicts of the last scan, kept next to
+# the log file
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+def parse_health_line(line):
+    # Returns (proxy_name, alive, timestamp, delay) for a mihomo health check
+    # line, or None for any other line. delay is the measured milliseconds,
+    # None for failed checks.
+    alive_match = ALIVE_PATTERN.search(line)
+    if not alive_match or not UID_PATTERN.search(line):
+        return None
 
+    # Extracting proxy name from the line
+    proxy_start = line.find("proxy: ") + len("proxy: ")
+    proxy_end = line.find(", url: ")
+    proxy_name = line[proxy_start:proxy_end].strip()
+    time_match = TIME_PATTERN.search(line)
+    timestamp = time_match.group(1) if time_match else None
+    alive = alive_match.group(1) == "true"
+    delay_match = DELAY_PATTERN.search(line)
+    delay = int(delay_match.group(1)) if alive and delay_match else None
+    return proxy_name, alive, timestamp, delay or None
 
-def extract_inactive_proxies(filename):
-    inactive_entries = []
-    uid_pattern = re.compile(r"uid: \{(.*?)\}")
-    alive_status_pattern = re.compile(r"alive: false")
 
+def checkpoint_path(log_path):
+    return f"{log_path}{CHECKPOINT_SUFFIX}"
+
+
+def load_checkpoint(log_path):
     try:
-        with open(filename, "r") as file:
-            lines = file.readlines()
-            # Process lines in reverse order to make sure it's start from the most recent test first
-            for line in reversed(lines):
-                if alive_status_pattern.search(line):
-                    match = uid_pattern.search(line)
-                    if match:
-                        uid = match.group(1)
-                        # Extracting proxy name from the line
-                        proxy_start = line.find("proxy: ") + len("proxy: ")
-                        proxy_end = line.find(", url: ")
-                        proxy_name = line[proxy_start:proxy_end].strip()
-                        if (
-                            proxy_name not in inactive_entries
-                            and proxy_name != "DIRECT"
-                        ):
-                            inactive_entries.append(proxy_name)
-    except TypeError:
-        return ""
-
-    return inactive_entries
-
-
-def clean_proxies(proxies_data):
+        with open(checkpoint_path(log_path), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"inode": None, "offset": 0, "proxies": {}}
+
+
+def save_checkpoint(log_path, checkpoint):
+    with atomic_write(checkpoint_path(log_path)) as file:
+        json.dump(checkpoint, file, ensure_ascii=False)
+
+
+def needs_full_scan(log_path, checkpoint):
+    stat = os.stat(log_path)
+    return checkpoint["inode"] != stat.st_ino or stat.st_size < checkpoint["offset"]
+
+
+def scan_log(log_path, checkpoint, observe=None):
+    # Stream the log from the checkpointed byte offset and fold every health
+    # check into checkpoint["proxies"]. A new inode or a file shorter than
+    # the offset means the log was rotated or truncated, so it is read from
+    # the start again and the old verdicts are dropped: a name the new log
+    # never mentions, or a new node reusing it, must not stay dead forever.
+    # Only complete lines move the offset forward.
+    if needs_full_scan(log_path, checkpoint):
+        checkpoint["inode"] = os.stat(log_path).st_ino
+        checkpoint["offset"] = 0
+        checkpoint["proxies"] = {}
+
+    scan_time = datetime.now().isoformat(timespec="seconds")
+    proxies = checkpoint["proxies"]
+    with open(log_path, "rb") as file:
+        file.seek(checkpoint["offset"])
+        offset = checkpoint["offset"]
+        for raw_line in file:
+            if not raw_line.endswith(b"\n"):
+                break
+            offset += len(raw_line)
+            parsed = parse_health_line(raw_line.decode("utf-8", errors="replace"))
+            if parsed is None:
+                continue
+            proxy_name, alive, timestamp, delay = parsed
+            if observe:
+                observe(proxy_name, alive, timestamp, delay)
+            state = proxies.setdefault(
+                proxy_name, {"alive": alive, "last_alive": None, "last_dead": None})
+            # Lines are read oldest first, so the latest verdict wins
+            state["alive"] = alive
+            state["last_alive" if alive else "last_dead"] = timestamp or scan_time
+        checkpoint["offset"] = offset
+    return checkpoint
+
+
+def iter_lines_reversed(log_path):
+    # Yield (line, end_offset) for the complete lines of log_path, newest
+    # first, straight from a memory map so the log is never loaded into a
+    # Python list
+    with open(log_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            line_end = data.rfind(b"\n") + 1
+            while line_end > 0:
+                line_start = data.rfind(b"\n", 0, line_end - 1) + 1
+                yield data[line_start:line_end], line_end
+                line_end = line_start
+
+
+def scan_log_reversed(log_path, checkpoint, proxy_names, observe=None):
+    # Full scan for a log without a usable checkpoint: read newest first and
+    # stop as soon as every proxy in proxy_names has a verdict. The newest
+    # line per proxy is its verdict, so older lines can be skipped and the
+    # checkpoint resumes after the last complete line. Verdicts from an
+    # earlier log are dropped, as in scan_log.
+    scan_time = datetime.now().isoformat(timespec="seconds")
+    proxies = checkpoint["proxies"] = {}
+    pending = set(proxy_names)
+    decided = set()
+    offset = None
+
+    for raw_line, line_end in iter_lines_reversed(log_path):
+        if offset is None:
+            offset = line_end
+        parsed = parse_health_line(raw_line.decode("utf-8", errors="replace"))
+        if parsed is None:
+            continue
+        proxy_name, alive, timestamp, delay = parsed
+        key = "last_alive" if alive else "last_dead"
+        if proxy_name not in decided:
+            decided.add(proxy_name)
+            if observe:
+                observe(proxy_name, alive, timestamp, delay)
+            proxies[proxy_name] = {
+                "alive": alive, "last_alive": None, "last_dead": None}
+            proxies[proxy_name][key] = timestamp or scan_time
+            pending.discard(proxy_name)
+            if not pending:
+                break
+        elif proxies[proxy_name][key] is None:
+            proxies[proxy_name][key] = timestamp or scan_time
+
+    checkpoint["inode"] = os.stat(log_path).st_ino
+    checkpoint["offset"] = offset or 0
+    return checkpoint
+
+
+def extract_inactive_proxies(filename, proxy_names=None, observe=None):
+    # Proxies whose most recent health check in the log failed. Progress is
+    # checkpointed next to the log so later runs only read new lines. When
+    # there is no usable checkpoint and the provider's proxy_names are known,
+    # the log is read backwards until each of them has a verdict. observe,
+    # if given, is called with (proxy_name, alive, timestamp, delay) for
+    # every health check read in this run.
+    if filename is None:
+        return set()
+
+    checkpoint = load_checkpoint(filename)
+    with metrics.timer("log_scan"):
+        if proxy_names and needs_full_scan(filename, checkpoint):
+            metrics.count("log_full_scans")
+            checkpoint = scan_log_reversed(
+                filename, checkpoint, proxy_names, observe)
+        else:
+            checkpoint = scan_log(filename, checkpoint, observe)
+    save_checkpoint(filename, checkpoint)
+    return {
+        proxy_name
+        for proxy_name, state in checkpoint["proxies"].items()
+        if not state["alive"] and proxy_name != "DIRECT"
+    }
+
+
+def record_log_health(proxies_data, log_path, health, min_score):
+    # Feed this run's log verdicts into the health history, then evict by
+    # score. Returns the surviving proxies in score order and the names of
+    # the evicted ones.
+    proxies_by_name = {proxy.get("name"): proxy for proxy in proxies_data}
+    observations = []
+
+    def observe(proxy_name, alive, timestamp, delay):
+        proxy = proxies_by_name.get(proxy_name)
+        if proxy is not None:
+            observations.append((proxy, alive, delay, timestamp))
+
+    extract_inactive_proxies(log_path, set(proxies_by_name), observe)
+    health.record_many(observations)
+    kept, evicted = health.rank(proxies_data, min_score)
+    return kept, {proxy.get("name") for proxy in evicted}
+
+
+def clean_proxies(proxies_data, log_path=None, health=None, min_score=MIN_SCORE):
     cleaned_proxies = []
-    inactive_proxies = extract_inactive_proxies(log_path)
+    if health is None:
+        inactive_proxies = extract_inactive_proxies(
+            log_path, {proxy.get("name") for proxy in proxies_data})
+    else:
+        proxies_data, inactive_proxies = record_log_health(
+            proxies_data, log_path, health, min_score)
 
     for proxy in proxies_data:
         servername = proxy.get("servername")
-        host = proxy.get("ws-opts", {}).get("headers", {}).get("Host")
-        path = proxy.get("path")
+        host = proxy_host(proxy)
+        path = proxy_path(proxy)
         proxy_name = proxy.get("name")
         proxy_dead = proxy_name in inactive_proxies
 
@@ -90,32 +225,51 @@ def clean_proxies(proxies_data):
         else:
             cleaned_proxies.append(proxy)
 
+    metrics.count("clean_dead", len(inactive_proxies))
+    metrics.count("clean_kept", len(cleaned_proxies))
     print(f"Number of dead proxies: {len(inactive_proxies)}")
     return {"proxies": cleaned_proxies}
 
 
-def main(proxies_path, log_path=None):
+def main(proxies_path, log_path=None, health_path=None, min_score=MIN_SCORE):
     proxies_data = load_yaml(proxies_path)
 
     if not proxies_data or "proxies" not in proxies_data:
         print("No proxies found in the provided YAML file.")
         return
+    proxies_data["proxies"] = from_dicts(proxies_data["proxies"])
 
-    cleaned_proxies_data = clean_proxies(proxies_data["proxies"])
+    if health_path:
+        with HealthStore(health_path) as health:
+            cleaned_proxies_data = clean_proxies(
+                proxies_data["proxies"], log_path, health, min_score)
+    else:
+        cleaned_proxies_data = clean_proxies(proxies_data["proxies"], log_path)
 
-    save_yaml(proxies_path, cleaned_proxies_data)
+    save_provider(proxies_path, cleaned_proxies_data)
 
-    if log_path:
-        # Optionally handle logging here, e.g., save logs to log_path
-        pass
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        usage="python clean_proxy_provider.py <proxies.yaml> [log_path] [--health health.db]"
+    )
+    parser.add_argument("proxies_path")
+    parser.add_argument("log_path", nargs="?")
+    parser.add_argument(
+        "--health", metavar="DB",
+        help="Record log verdicts in a health history and evict by score")
+    parser.add_argument(
+        "--min-score", type=float, default=MIN_SCORE,
+        help="Health score below which a proxy is evicted")
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Usage: python clean_proxies.py <proxies.yaml> [log_path]")
-        sys.exit(1)
 
-    proxies_path = sys.argv[1]
-    log_path = sys.argv[2] if len(sys.argv) == 3 else None
+def cli(argv=None):
+    args = parse_args(argv)
+    main(args.proxies_path, args.log_path, args.health, args.min_score)
+    metrics.write_reports(args)
 
-    main(proxies_path, log_path)
+
+if __name__ == "__main__":
+    cli()
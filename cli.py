@@ -0,0 +1,222 @@
+import argparse
+import importlib
+import os
+import sys
+from contextlib import nullcontext
+
+# Subcommands that run one script's own command line, as module and
+# function. Modules are imported only when their subcommand runs, so e.g.
+# merge never loads requests and clean never loads tqdm.
+SCRIPT_COMMANDS = {
+    "fetch": ("v2raysubtoyaml", "main"),
+    "merge": ("append_proxies", "cli"),
+    "clean": ("clean_proxy_provider", "cli"),
+    "probe": ("test_servers", "cli"),
+    "scan": ("front_scanner", "main"),
+    "serve": ("refresh_service", "main"),
+}
+SCRIPT_HELP = {
+    "fetch": "Download and convert subscriptions (v2raysubtoyaml.py)",
+    "merge": "Merge proxy files into a provider (append_proxies.py)",
+    "clean": "Remove dead proxies using the mihomo log (clean_proxy_provider.py)",
+    "probe": "Remove unreachable proxies (test_servers.py)",
+    "scan": "Rank CDN front addresses (front_scanner.py)",
+    "serve": "Refresh the provider periodically, optionally over HTTP (refresh_service.py)",
+}
+
+# Port whose server-rewritten split is merged into the provider by sync,
+# like append_proxies_and_clean.sh merging canonical/proxies_updated_80.yaml
+SYNC_PORT = 80
+
+
+def convert(argv):
+    import v2raysubtoyaml
+    from yaml_io import save_provider
+
+    parser = argparse.ArgumentParser(
+        prog="cli.py convert",
+        description="Convert a saved vmess subscription to a clash meta provider",
+    )
+    parser.add_argument("subscription", help="Subscription file, base64 or decoded")
+    parser.add_argument(
+        "-o", "--output", default="proxies.yaml", help="Provider file to write")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Processes used to convert large subscriptions (0 = all CPUs)")
+    args = parser.parse_args(argv)
+
+    decoded_data = v2raysubtoyaml.decode_subscription_file(args.subscription)
+    clash_config = v2raysubtoyaml.convert_v2ray_to_clash(decoded_data, args.workers)
+    save_provider(args.output, clash_config, flow_style=True)
+
+
+def parse_sync_args(argv):
+    import metrics
+
+    parser = argparse.ArgumentParser(
+        prog="cli.py sync",
+        description="Fetch, convert, merge, clean and optionally probe in one "
+        "process, handing proxies from stage to stage in memory",
+    )
+    parser.add_argument("provider_path", help="Proxy provider file clash-meta reads")
+    parser.add_argument(
+        "log_path", nargs="?",
+        help="mihomo debug log used to clean dead proxies")
+    parser.add_argument(
+        "--url", action="append", dest="urls", default=[],
+        help="Subscription url (repeatable; defaults to the built-in list)")
+    parser.add_argument(
+        "--port", type=int, default=SYNC_PORT,
+        help="Port whose server-rewritten proxies are merged into the provider")
+    parser.add_argument(
+        "--cdn-server", action="append", dest="cdn_servers",
+        help="Server address written into the merged proxies")
+    parser.add_argument(
+        "--front-cache", metavar="FILE",
+        help="Spread merged proxies across the fronts ranked in FILE")
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Decode, convert and write each subscription while it downloads")
+    parser.add_argument(
+        "--health", metavar="DB",
+        help="Health history used when cleaning and probing")
+    parser.add_argument(
+        "--min-score", type=float, default=None,
+        help="Health score below which a proxy is evicted")
+    parser.add_argument(
+        "--probe", action="store_true",
+        help="Drop proxies that fail a TCP connect before saving")
+    parser.add_argument(
+        "--deep", action="store_true",
+        help="Probe with a TLS handshake and WebSocket upgrade (implies --probe)")
+    parser.add_argument(
+        "--dns-cache", metavar="FILE",
+        help="Persist resolved addresses to FILE between runs")
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def converter_argv(args):
+    argv = list(args.urls)
+    if args.front_cache:
+        argv += ["--front-cache", args.front_cache]
+    for server in args.cdn_servers or []:
+        argv += ["--cdn-server", server]
+    if args.stream:
+        argv.append("--stream")
+    return argv
+
+
+def load_provider(provider_path):
+    from proxy_node import from_dicts
+    from yaml_io import load_yaml
+
+    data = load_yaml(provider_path) if os.path.exists(provider_path) else None
+    if not data:
+        data = {}
+    data["proxies"] = from_dicts(data.get("proxies") or [])
+    return data
+
+
+def sync(argv):
+    # The whole append_proxies_and_clean.sh pipeline in one interpreter. The
+    # canonical proxies go straight from the converter into the merge, and
+    # the provider is read once and written once at the end.
+    import append_proxies
+    import clean_proxy_provider
+    import dns_cache
+    import metrics
+    import v2raysubtoyaml
+    from health_store import MIN_SCORE, HealthStore
+    from yaml_io import save_provider
+
+    args = parse_sync_args(argv)
+    if args.dns_cache:
+        dns_cache.use_cache_file(args.dns_cache)
+    min_score = MIN_SCORE if args.min_score is None else args.min_score
+
+    converter_args = v2raysubtoyaml.parse_args(converter_argv(args))
+    # An unchanged run skips the rebuild; the last canonical list still
+    # feeds the merge so the provider is cleaned and probed as usual
+    canonical = v2raysubtoyaml.run(converter_args) or v2raysubtoyaml.load_canonical(
+        converter_args.canonical_dir)
+    if canonical is None or not canonical[0]:
+        print("No proxies from any subscription, the provider is left unchanged.")
+        return
+    new_server = (v2raysubtoyaml.cdn_servers(converter_args) or v2raysubtoyaml.CDN_SERVERS)[0]
+    new_proxies = [
+        v2raysubtoyaml.update_proxy_server(proxy, new_server)
+        for proxy in v2raysubtoyaml.iter_proxies_by_port(canonical[0], args.port)
+    ]
+
+    provider = load_provider(args.provider_path)
+    original = {"proxies": list(provider["proxies"])}
+    merged, _ = append_proxies.merge_many_proxies([{"proxies": new_proxies}], provider)
+
+    with HealthStore(args.health) if args.health else nullcontext() as health:
+        cleaned = clean_proxy_provider.clean_proxies(
+            merged["proxies"], args.log_path, health, min_score)
+        proxies = cleaned["proxies"]
+
+        if args.probe or args.deep:
+            import test_servers
+
+            results = test_servers.check_proxies(proxies, deep=args.deep)
+            if health is None:
+                proxies = test_servers.remove_unreachable_proxies(
+                    proxies, verbose=False, results=results)
+            else:
+                # Like test_servers.py --health: one failed probe only counts
+                # against the score, eviction is by accumulated history
+                health.record_many(
+                    (result["proxy"], result["latency"] is not None, result["latency"], None)
+                    for result in results
+                )
+                proxies, _ = health.rank(proxies, min_score)
+
+    provider["proxies"] = proxies
+    if append_proxies.compare_proxies(provider, original):
+        append_proxies.backup_file(args.provider_path)
+        save_provider(args.provider_path, provider)
+
+    dns_cache.default_resolver.save()
+    metrics.write_reports(args)
+
+
+def parse_args(argv=None):
+    commands = ["convert", "sync", *SCRIPT_COMMANDS]
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Single entry point for the proxy provider tools. Every "
+        "subcommand takes its own options; see cli.py <command> -h.",
+        epilog="\n".join(
+            [
+                "commands:",
+                "  convert  Convert a saved subscription file to a provider",
+                "  sync     Run fetch, merge, clean (and probe) in one process",
+                *(f"  {name:<8} {SCRIPT_HELP[name]}" for name in SCRIPT_COMMANDS),
+            ]
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=commands, metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "convert":
+        convert(args.args)
+    elif args.command == "sync":
+        sync(args.args)
+    else:
+        module_name, function_name = SCRIPT_COMMANDS[args.command]
+        module = importlib.import_module(module_name)
+        # The scripts name themselves after sys.argv[0] in their usage text
+        sys.argv[0] = f"cli.py {args.command}"
+        getattr(module, function_name)(args.args)
+
+
+if __name__ == "__main__":
+    main()
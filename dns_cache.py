@@ -0,0 +1,148 @@
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+
+# Seconds a successful / failed lookup stays cached. getaddrinfo does not
+# expose record TTLs, so these act as an upper bound on record lifetime.
+DEFAULT_TTL = 300
+NEGATIVE_TTL = 60
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class DnsCache:
+    # Forward and reverse lookup cache shared by conversion and probing.
+    # Entries expire after ttl (negative_ttl for failures) and can be
+    # persisted to a JSON file between runs.
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=NEGATIVE_TTL, cache_path=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_path = cache_path
+        self.addresses = {}
+        self.hostnames = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        if cache_path:
+            self.load()
+
+    def _get(self, table, key):
+        with self.lock:
+            entry = table.get(key)
+        if entry and entry[0] > time.time():
+            return True, entry[1]
+        return False, None
+
+    def _put(self, table, key, value):
+        ttl = self.ttl if value else self.negative_ttl
+        with self.lock:
+            table[key] = (time.time() + ttl, value)
+
+    @staticmethod
+    def _lookup(host):
+        # Every A/AAAA record in getaddrinfo order, without duplicates, so a
+        # caller can fall back to the next address like create_connection
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError):
+            return None
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        return addresses or None
+
+    def resolve_all(self, host):
+        # Returns the list of addresses for host, or None if it does not
+        # resolve
+        if is_ip_address(host):
+            return [host]
+        hit, address = self._get(self.addresses, host)
+        if hit:
+            return address
+        address = self._lookup(host)
+        self._put(self.addresses, host, address)
+        return address
+
+    async def resolve_all_async(self, host):
+        # Concurrent lookups of the same host share one getaddrinfo call
+        if is_ip_address(host):
+            return [host]
+        hit, address = self._get(self.addresses, host)
+        if hit:
+            return address
+
+        loop = asyncio.get_running_loop()
+        future = self.pending.get(host)
+        if future is None or future.get_loop() is not loop:
+            future = loop.run_in_executor(None, self._lookup, host)
+            self.pending[host] = future
+        try:
+            address = await future
+        finally:
+            if self.pending.get(host) is future:
+                del self.pending[host]
+        self._put(self.addresses, host, address)
+        return address
+
+    def reverse(self, ip_address):
+        # Returns the hostname for ip_address, or None if it has no PTR record
+        hit, hostname = self._get(self.hostnames, ip_address)
+        if hit:
+            return hostname
+        try:
+            hostname = socket.gethostbyaddr(ip_address)[0]
+        except (socket.herror, socket.gaierror, OSError) as e:
+            print(f"Could not resolve hostname for IP {ip_address}: {e}")
+            hostname = None
+        self._put(self.hostnames, ip_address, hostname)
+        return hostname
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable DNS cache {self.cache_path}: {e}")
+            return
+        now = time.time()
+        with self.lock:
+            for name, table in (("addresses", self.addresses), ("hostnames", self.hostnames)):
+                for key, (expires, value) in data.get(name, {}).items():
+                    # Caches written before address lists held one address
+                    if name == "addresses" and isinstance(value, str):
+                        value = [value]
+                    if expires > now:
+                        table[key] = (expires, value)
+
+    def save(self):
+        if not self.cache_path:
+            return
+        now = time.time()
+        with self.lock:
+            data = {
+                name: {key: entry for key, entry in table.items() if entry[0] > now}
+                for name, table in (("addresses", self.addresses), ("hostnames", self.hostnames))
+            }
+        from yaml_io import atomic_write
+
+        with atomic_write(self.cache_path) as file:
+            json.dump(data, file)
+
+
+default_resolver = DnsCache()
+
+
+def use_cache_file(cache_path):
+    # Attach a persisted cache file to the shared resolver
+    default_resolver.cache_path = cache_path
+    default_resolver.load()
+    return default_resolver
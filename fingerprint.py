@@ -0,0 +1,91 @@
+import hashlib
+
+from proxy_node import ProxyNode, copy_proxy
+
+
+def proxy_identity(proxy):
+    # The fields that decide where a proxy actually connects. Name, cipher
+    # and client flags are left out so a renamed node is still the same node.
+    if isinstance(proxy, ProxyNode):
+        path, host = proxy.ws_path, proxy.ws_host
+    else:
+        ws_opts = proxy.get("ws-opts") or {}
+        path, host = ws_opts.get("path"), (ws_opts.get("headers") or {}).get("Host")
+    try:
+        port = int(proxy.get("port") or 0)
+    except (TypeError, ValueError):
+        port = proxy.get("port")
+    return (
+        proxy.get("type") or "",
+        str(proxy.get("server") or "").lower(),
+        port,
+        proxy.get("uuid") or "",
+        proxy.get("network") or "",
+        path or "",
+        str(host or proxy.get("servername") or "").lower(),
+    )
+
+
+def proxy_fingerprint(proxy):
+    identity = "\x1f".join(str(field) for field in proxy_identity(proxy))
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def merge_fingerprint(proxy):
+    # proxy_fingerprint with the server folded into the host: the real host
+    # is the servername or ws Host when there is one, else the server itself
+    # (update_proxy_server moves it into servername). A proxy rewritten onto
+    # a CDN front is then the same node as its canonical original and
+    # whichever front it landed on, so merging a refresh that moved it
+    # replaces the old entry instead of adding a copy.
+    identity = proxy_identity(proxy)
+    identity = identity[:1] + identity[2:6] + (identity[6] or identity[1],)
+    identity = "\x1f".join(str(field) for field in identity)
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def merge_index(proxies):
+    # fingerprint_index keyed by merge_fingerprint
+    return {merge_fingerprint(proxy): proxy for proxy in proxies}
+
+
+def fingerprint_index(proxies):
+    # fingerprint -> proxy, computing each fingerprint once. Later
+    # duplicates win, like a name-keyed dict merge.
+    return {proxy_fingerprint(proxy): proxy for proxy in proxies}
+
+
+def diff_proxies(new_proxies, old_proxies):
+    # Set-based diff on fingerprints. "changed" holds new proxies whose
+    # fingerprint exists on the old side with different contents.
+    new_index = fingerprint_index(new_proxies)
+    old_index = fingerprint_index(old_proxies)
+    new_keys = new_index.keys()
+    old_keys = old_index.keys()
+    return {
+        "added": [new_index[key] for key in new_keys - old_keys],
+        "removed": [old_index[key] for key in old_keys - new_keys],
+        "changed": [
+            new_index[key] for key in new_keys & old_keys
+            if new_index[key] != old_index[key]
+        ],
+    }
+
+
+def ensure_unique_names(proxies):
+    # clash-meta needs unique names inside a provider. Distinct nodes often
+    # share names across sources ("Unnamed", a lone flag), so later ones
+    # get a numeric suffix.
+    seen = set()
+    unique = []
+    for proxy in proxies:
+        name = proxy.get("name")
+        if name in seen:
+            counter = 2
+            while f"{name} {counter}" in seen:
+                counter += 1
+            proxy = copy_proxy(proxy)
+            proxy["name"] = f"{name} {counter}"
+        seen.add(proxy.get("name"))
+        unique.append(proxy)
+    return unique
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from tqdm import tqdm
+
+import metrics
+import test_servers
+from yaml_io import atomic_write
+
+# Scan tuning: simultaneous connection attempts, seconds per attempt,
+# attempts per address (loss is the failed fraction) and how many addresses
+# are drawn from each CIDR block
+CONCURRENCY = 1000
+SCAN_TIMEOUT = 2
+SAMPLES = 3
+PER_NETWORK = 256
+PORT = 443
+
+# Cache: how many ranked fronts are kept, how many are used by default,
+# the highest loss a usable front may have and seconds before a scan is
+# considered stale
+KEEP = 50
+TOP_N = 4
+MAX_LOSS = 0.34
+MAX_AGE = 24 * 3600
+FRONT_CACHE = "fronts.json"
+
+
+def expand_candidates(specs, per_network=PER_NETWORK, rng=None):
+    # Addresses to scan from a mix of single IPs and CIDR blocks. Blocks
+    # larger than per_network contribute a random sample of their hosts.
+    rng = rng or random.Random()
+    seen = set()
+    addresses = []
+    for spec in specs:
+        try:
+            network = ipaddress.ip_network(spec.strip(), strict=False)
+        except ValueError:
+            print(f"Skipping invalid address or network: {spec}")
+            continue
+        if network.version == 4 and network.num_addresses > 2:
+            # Skip the network and broadcast addresses
+            first, size = 1, network.num_addresses - 2
+        else:
+            first, size = 0, network.num_addresses
+        if size <= per_network:
+            hosts = [network[first + index] for index in range(size)]
+        else:
+            # randrange copes with IPv6 blocks too large for sample()
+            indexes = set()
+            while len(indexes) < per_network:
+                indexes.add(rng.randrange(size))
+            hosts = [network[first + index] for index in indexes]
+        for host in hosts:
+            address = str(host)
+            if address not in seen:
+                seen.add(address)
+                addresses.append(address)
+    return addresses
+
+
+def read_candidates(file_path):
+    # One IP or CIDR per line; blank lines and # comments are ignored
+    with open(file_path, "r") as file:
+        lines = (line.split("#", 1)[0].strip() for line in file)
+        return [line for line in lines if line]
+
+
+async def measure_front(address, port, samples, timeout, sni):
+    # Connect latency over samples attempts, with a TLS handshake when sni
+    # is given (the latency then covers both). Failed attempts count as loss.
+    times = []
+    for _ in range(samples):
+        latency = await test_servers.connect_once(address, port, timeout, sni)
+        if latency is not None:
+            times.append(latency)
+    return {
+        "address": address,
+        "latency": statistics.median(times) if times else None,
+        "loss": 1 - len(times) / samples,
+    }
+
+
+async def scan_addresses(addresses, port, samples, timeout, sni, concurrency, pbar):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scan(address):
+        async with semaphore:
+            result = await measure_front(address, port, samples, timeout, sni)
+        pbar.update(1)
+        return result
+
+    return await asyncio.gather(*(scan(address) for address in addresses))
+
+
+def scan_fronts(
+    addresses,
+    port=PORT,
+    samples=SAMPLES,
+    timeout=SCAN_TIMEOUT,
+    sni=None,
+    concurrency=CONCURRENCY,
+):
+    # Probe every candidate concurrently. Returns one result per address.
+    with metrics.timer("front_scan"), tqdm(total=len(addresses), unit="ip") as pbar:
+        results = asyncio.run(
+            scan_addresses(addresses, port, samples, timeout, sni, concurrency, pbar))
+    reachable = sum(result["latency"] is not None for result in results)
+    metrics.count("front_reachable", reachable)
+    metrics.count("front_unreachable", len(results) - reachable)
+    return results
+
+
+def rank_fronts(results, max_loss=MAX_LOSS):
+    # Usable fronts, least loss first and then fastest
+    usable = [
+        result for result in results
+        if result["latency"] is not None and result["loss"] <= max_loss
+    ]
+    usable.sort(key=lambda result: (result["loss"], result["latency"]))
+    return usable
+
+
+def save_front_cache(file_path, ranked, port, sni):
+    data = {"scanned": time.time(), "port": port, "sni": sni, "fronts": ranked}
+    with atomic_write(file_path) as file:
+        json.dump(data, file, indent=2)
+    print(f"Ranked fronts have been written to {file_path}")
+
+
+def load_fronts(file_path=FRONT_CACHE, top_n=TOP_N, max_age=MAX_AGE):
+    # The top_n addresses of the last scan, or an empty list when there is
+    # no usable scan (missing, unreadable or older than max_age seconds)
+    if not file_path or not os.path.exists(file_path):
+        return []
+    try:
+        with open(file_path, "r") as file:
+            data = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable front cache {file_path}: {e}")
+        return []
+    if max_age and time.time() - data.get("scanned", 0) > max_age:
+        print(f"Front cache {file_path} is stale, rescan with front_scanner.py")
+        return []
+    return [front["address"] for front in data.get("fronts", [])[:top_n]]
+
+
+def print_fronts(ranked, count):
+    print(f"\nBest fronts ({len(ranked)} usable):")
+    for front in ranked[:count]:
+        print(f"- {front['address']}: {front['latency']:.0f} ms, loss {front['loss']:.0%}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Scan candidate CDN front addresses and keep a ranked "
+        "cache of the best ones for v2raysubtoyaml --front-cache"
+    )
+    parser.add_argument(
+        "candidates", nargs="*",
+        help="IP addresses and CIDR blocks to scan")
+    parser.add_argument(
+        "--file", metavar="FILE",
+        help="Also read candidates from FILE, one per line")
+    parser.add_argument(
+        "--cache", default=FRONT_CACHE,
+        help="Where the ranked fronts are written")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to probe")
+    parser.add_argument(
+        "--sni", metavar="HOST",
+        help="Do a TLS handshake with this SNI instead of a bare TCP connect")
+    parser.add_argument(
+        "--samples", type=int, default=SAMPLES,
+        help="Attempts per address; failed attempts count as loss")
+    parser.add_argument(
+        "--timeout", type=float, default=SCAN_TIMEOUT,
+        help="Seconds allowed for each attempt")
+    parser.add_argument(
+        "--concurrency", type=int, default=CONCURRENCY,
+        help="Maximum simultaneous connection attempts")
+    parser.add_argument(
+        "--per-network", type=int, default=PER_NETWORK,
+        help="Addresses sampled from each CIDR block")
+    parser.add_argument(
+        "--max-loss", type=float, default=MAX_LOSS,
+        help="Highest loss fraction a front may have to be kept")
+    parser.add_argument(
+        "--keep", type=int, default=KEEP,
+        help="How many ranked fronts are stored")
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    specs = list(args.candidates)
+    if args.file:
+        specs.extend(read_candidates(args.file))
+    addresses = expand_candidates(specs, args.per_network)
+    if not addresses:
+        print("No candidate addresses to scan.")
+        sys.exit(1)
+
+    print(f"Scanning {len(addresses)} addresses on port {args.port}")
+    results = scan_fronts(
+        addresses, args.port, args.samples, args.timeout, args.sni, args.concurrency)
+    ranked = rank_fronts(results, args.max_loss)
+    print_fronts(ranked, TOP_N)
+    if ranked:
+        save_front_cache(args.cache, ranked[: args.keep], args.port, args.sni)
+    else:
+        # Keep the previous ranking rather than replacing it with nothing
+        print(f"No usable fronts found, {args.cache} left unchanged")
+    metrics.write_reports(args)
+
+
+if __name__ == "__main__":
+    main()
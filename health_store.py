@@ -0,0 +1,201 @@
+import json
+import sqlite3
+import sys
+from datetime import datetime
+
+from fingerprint import merge_fingerprint
+from proxy_node import to_dict
+from yaml_io import atomic_write, dump_yaml
+
+# Weight of the newest latency sample in the moving average
+EWMA_ALPHA = 0.3
+# Proxies scoring below MIN_SCORE are evicted, but only once they have
+# been checked at least MIN_CHECKS times
+MIN_SCORE = 0.3
+MIN_CHECKS = 3
+# Score given to proxies without enough history
+NEUTRAL_SCORE = 0.5
+# Bumped whenever the fingerprint column changes meaning; older histories
+# are rekeyed on open
+SCHEMA_VERSION = 2
+
+
+def health_score(successes, failures):
+    # Smoothed success rate: one lucky or unlucky check moves it only a little
+    return (successes + 1) / (successes + failures + 2)
+
+
+class HealthStore:
+    # Health history per merge_fingerprint, so a proxy keeps its history
+    # when a front rescan moves it to another server. Fed by both the mihomo
+    # log cleaner and the active tester. Eviction and provider order come from
+    # the accumulated score instead of a single failed check.
+    def __init__(self, path, alpha=EWMA_ALPHA):
+        self.path = path
+        self.alpha = alpha
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS health (
+                fingerprint TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                data TEXT NOT NULL,
+                successes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                ewma_latency REAL,
+                last_seen TEXT,
+                last_success TEXT
+            )
+            """
+        )
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.rekey()
+
+    def rekey(self):
+        # Recompute every fingerprint from the stored data. Rows that now
+        # share one add up their counts; the most recently seen row supplies
+        # the proxy data and the latency average.
+        rows = self.db.execute(
+            """
+            SELECT name, data, successes, failures, ewma_latency, last_seen, last_success
+            FROM health ORDER BY COALESCE(last_seen, '')
+            """
+        ).fetchall()
+        merged = {}
+        for row in rows:
+            fingerprint = merge_fingerprint(json.loads(row[1]))
+            previous = merged.get(fingerprint)
+            if previous is not None:
+                row = (
+                    *row[:2],
+                    previous[2] + row[2],
+                    previous[3] + row[3],
+                    row[4] if row[4] is not None else previous[4],
+                    row[5] or previous[5],
+                    max(filter(None, (previous[6], row[6])), default=None),
+                )
+            merged[fingerprint] = row
+        with self.db:
+            self.db.execute("DELETE FROM health")
+            self.db.executemany(
+                """
+                INSERT INTO health (fingerprint, name, data, successes, failures,
+                    ewma_latency, last_seen, last_success)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                ((fingerprint, *row) for fingerprint, row in merged.items()),
+            )
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record_many(self, observations):
+        # observations: (proxy, alive, latency_ms or None, timestamp or None)
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.db:
+            for proxy, alive, latency, seen_at in observations:
+                fingerprint = merge_fingerprint(proxy)
+                seen_at = seen_at or now
+                data = json.dumps(to_dict(proxy), ensure_ascii=False)
+                row = self.db.execute(
+                    "SELECT ewma_latency, data FROM health WHERE fingerprint = ?",
+                    (fingerprint,),
+                ).fetchone()
+                if row is None:
+                    self.db.execute(
+                        "INSERT INTO health (fingerprint, name, data) VALUES (?, ?, ?)",
+                        (fingerprint, proxy["name"], data),
+                    )
+                    ewma_latency = None
+                else:
+                    ewma_latency = row[0]
+                    if row[1] != data:
+                        # The proxy moved to another front or was renamed
+                        self.db.execute(
+                            "UPDATE health SET name = ?, data = ? WHERE fingerprint = ?",
+                            (proxy["name"], data, fingerprint),
+                        )
+
+                if alive:
+                    if latency is not None:
+                        ewma_latency = latency if ewma_latency is None else (
+                            self.alpha * latency + (1 - self.alpha) * ewma_latency)
+                    self.db.execute(
+                        """
+                        UPDATE health SET successes = successes + 1, ewma_latency = ?,
+                            last_seen = ?, last_success = ?
+                        WHERE fingerprint = ?
+                        """,
+                        (ewma_latency, seen_at, seen_at, fingerprint),
+                    )
+                else:
+                    self.db.execute(
+                        "UPDATE health SET failures = failures + 1, last_seen = ? WHERE fingerprint = ?",
+                        (seen_at, fingerprint),
+                    )
+
+    def record(self, proxy, alive, latency=None, seen_at=None):
+        self.record_many([(proxy, alive, latency, seen_at)])
+
+    def stats(self, proxy):
+        row = self.db.execute(
+            "SELECT successes, failures, ewma_latency FROM health WHERE fingerprint = ?",
+            (merge_fingerprint(proxy),),
+        ).fetchone()
+        return row if row else (0, 0, None)
+
+    def latencies(self):
+        # merge_fingerprint -> EWMA latency for every measured proxy
+        return dict(self.db.execute(
+            "SELECT fingerprint, ewma_latency FROM health WHERE ewma_latency IS NOT NULL"))
+
+    def rank(self, proxies, min_score=MIN_SCORE, min_checks=MIN_CHECKS):
+        # Returns (kept, evicted). kept is ordered by score, best first, then
+        # by EWMA latency; proxies with too little history are kept with a
+        # neutral score.
+        kept = []
+        evicted = []
+        for proxy in proxies:
+            successes, failures, ewma_latency = self.stats(proxy)
+            if successes + failures < min_checks:
+                score = NEUTRAL_SCORE
+            else:
+                score = health_score(successes, failures)
+                if score < min_score:
+                    evicted.append(proxy)
+                    continue
+            latency_key = ewma_latency if ewma_latency is not None else float("inf")
+            kept.append((-score, latency_key, proxy))
+        kept.sort(key=lambda entry: entry[:2])
+        return [proxy for _, _, proxy in kept], evicted
+
+    def export(self, min_score=MIN_SCORE, min_checks=MIN_CHECKS):
+        # Rebuild a provider from every proxy in the history
+        proxies = [json.loads(data) for (data,) in self.db.execute("SELECT data FROM health")]
+        kept, _ = self.rank(proxies, min_score, min_checks)
+        return {"proxies": kept}
+
+
+def main(argv):
+    if len(argv) not in (4, 5) or argv[2] != "export":
+        print("Usage: python health_store.py <health.db> export <proxies.yaml> [min_score]")
+        sys.exit(1)
+
+    health_path, _, yaml_path = argv[1:4]
+    min_score = float(argv[4]) if len(argv) == 5 else MIN_SCORE
+    with HealthStore(health_path) as health:
+        data = health.export(min_score)
+    with atomic_write(yaml_path) as file:
+        dump_yaml(data, file)
+    print(f"Exported {len(data['proxies'])} proxies to {yaml_path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = "vmess_sub"
+
+
+class Metrics:
+    # Per-stage timings and outcome counters for one run, exported as a
+    # JSON report or a Prometheus textfile
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            calls, total, longest = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = (calls + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "duration_seconds": time.time() - self.started,
+                "stages": {
+                    stage: {"calls": calls, "seconds": total, "max_seconds": longest}
+                    for stage, (calls, total, longest) in sorted(self.stages.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def write_json(self, file_path):
+        # Imported here because yaml_io itself reports to metrics
+        from yaml_io import atomic_write
+
+        with atomic_write(file_path) as file:
+            json.dump(self.report(), file, indent=2)
+
+    def write_prometheus(self, file_path):
+        from yaml_io import atomic_write
+
+        report = self.report()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_run_started_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_started_seconds {report['started']:.3f}",
+            f"# TYPE {PROMETHEUS_PREFIX}_run_duration_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_duration_seconds {report['duration_seconds']:.6f}",
+        ]
+        # Every sample of a metric family has to follow its TYPE line
+        for field, metric in (
+            ("seconds", "stage_seconds"),
+            ("max_seconds", "stage_max_seconds"),
+            ("calls", "stage_calls"),
+        ):
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} gauge")
+            for stage, values in report["stages"].items():
+                lines.append(
+                    f'{PROMETHEUS_PREFIX}_{metric}{{stage="{stage}"}} {values[field]}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_events gauge")
+        for name, value in report["counters"].items():
+            lines.append(f'{PROMETHEUS_PREFIX}_events{{name="{name}"}} {value}')
+        with atomic_write(file_path) as file:
+            file.write("\n".join(lines) + "\n")
+
+
+default_metrics = Metrics()
+timer = default_metrics.timer
+count = default_metrics.count
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--report", metavar="FILE",
+        help="Write per-stage timings and counters as JSON to FILE")
+    parser.add_argument(
+        "--prometheus", metavar="FILE",
+        help="Write the same metrics in Prometheus textfile format to FILE")
+
+
+def write_reports(args):
+    if getattr(args, "report", None):
+        default_metrics.write_json(args.report)
+    if getattr(args, "prometheus", None):
+        default_metrics.write_prometheus(args.prometheus)
@@ -0,0 +1,241 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from fingerprint import merge_fingerprint
+from proxy_node import copy_proxy, from_dicts
+from yaml_io import dump_yaml, file_signature, load_yaml
+
+HOST = "127.0.0.1"
+PORT = 8090
+# Rendered responses kept per provider version, and how often the
+# standalone server checks its files for changes
+RENDER_CACHE_SIZE = 64
+RELOAD_INTERVAL = 5
+
+
+def select_proxies(proxies, provenance, latencies, port=None, source=None, top=None):
+    # Filters offered to clients: a single port, proxies seen in a source
+    # whose url contains source, and the top N by measured latency.
+    # latencies is keyed by merge_fingerprint, so canonical proxies match
+    # the history of their rewritten copies in the provider.
+    selected = proxies
+    if port is not None:
+        selected = [proxy for proxy in selected if proxy.get("port") == port]
+    if source:
+        selected = [
+            proxy for proxy in selected
+            if any(source in url for url in provenance.get(proxy.get("name"), {}).get("sources", []))
+        ]
+    if top:
+        ranked = [
+            (latencies.get(merge_fingerprint(proxy), float("inf")), index, proxy)
+            for index, proxy in enumerate(selected)
+        ]
+        ranked.sort(key=lambda entry: entry[:2])
+        selected = [proxy for _, _, proxy in ranked[:top]]
+    return selected
+
+
+def rewrite_server(proxies, new_server):
+    updated = []
+    for proxy in proxies:
+        proxy = copy_proxy(proxy)
+        if not proxy.get("servername"):
+            proxy["servername"] = proxy.get("server")
+        proxy["server"] = new_server
+        updated.append(proxy)
+    return updated
+
+
+class ProviderState:
+    # The proxies being served, plus a cache of rendered responses that is
+    # dropped whenever update() publishes a new list
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.proxies = []
+        self.provenance = {}
+        self.latencies = {}
+        self.version = 0
+        self.renders = {}
+
+    def update(self, proxies, provenance=None, latencies=None):
+        with self.lock:
+            self.proxies = list(proxies)
+            self.provenance = provenance or {}
+            self.latencies = latencies or {}
+            self.version += 1
+            self.renders = {}
+
+    def render(self, query):
+        # Returns (body, gzipped body, etag) for a normalised query tuple
+        with self.lock:
+            cached = self.renders.get(query)
+            if cached:
+                return cached
+            proxies, provenance, latencies = self.proxies, self.provenance, self.latencies
+            version = self.version
+
+        port, source, top, server = query
+        selected = select_proxies(proxies, provenance, latencies, port, source, top)
+        if server:
+            selected = rewrite_server(selected, server)
+        body = dump_yaml({"proxies": selected}).encode("utf-8")
+        rendered = (
+            body,
+            gzip.compress(body, compresslevel=6),
+            '"' + hashlib.sha1(body).hexdigest() + '"',
+        )
+
+        with self.lock:
+            # An update() while rendering has published a newer list; the
+            # stale body is still returned but must not be cached for it
+            if self.version == version:
+                if len(self.renders) >= RENDER_CACHE_SIZE:
+                    self.renders.clear()
+                self.renders[query] = rendered
+        return rendered
+
+
+def parse_query(path):
+    params = parse_qs(urlparse(path).query)
+
+    def first(name):
+        values = params.get(name)
+        return values[0] if values else None
+
+    port = first("port")
+    top = first("top")
+    top = int(top) if top else None
+    if top is not None and top < 1:
+        raise ValueError("top must be at least 1")
+    return (
+        int(port) if port else None,
+        first("source"),
+        top,
+        first("server"),
+    )
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    state = None
+    quiet = True
+
+    def do_GET(self):
+        route = urlparse(self.path).path
+        if route == "/healthz":
+            self.send_plain(200, b"ok\n")
+            return
+        if route != "/proxies":
+            self.send_plain(404, b"not found\n")
+            return
+
+        try:
+            query = parse_query(self.path)
+        except ValueError:
+            self.send_plain(400, b"port and top must be integers, top at least 1\n")
+            return
+
+        body, gzipped, etag = self.state.render(query)
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        payload = gzipped if use_gzip else body
+        self.send_response(200)
+        self.send_header("Content-Type", "text/yaml; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_plain(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def start_server(state, host=HOST, port=PORT, quiet=True):
+    # Serve state on a background thread; returns the server so the caller
+    # can shut it down
+    handler = type("BoundProviderHandler", (ProviderHandler,), {"state": state, "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving proxies on http://{host}:{port}/proxies")
+    return server
+
+
+def load_files(state, provider_path, provenance_path=None, health_path=None):
+    data = load_yaml(provider_path) or {}
+    provenance = {}
+    if provenance_path and os.path.exists(provenance_path):
+        with open(provenance_path, "r") as file:
+            provenance = json.load(file)
+    latencies = {}
+    if health_path:
+        from health_store import HealthStore
+
+        with HealthStore(health_path) as health:
+            latencies = health.latencies()
+    state.update(from_dicts(data.get("proxies") or []), provenance, latencies)
+    print(f"Loaded {len(state.proxies)} proxies from {provider_path}")
+
+
+def watch_files(state, provider_path, provenance_path=None, health_path=None):
+    # Standalone mode: load the files, then reload whenever one changes
+    paths = [path for path in (provider_path, provenance_path, health_path) if path]
+
+    def signatures():
+        return [file_signature(path) if os.path.exists(path) else None for path in paths]
+
+    loaded = signatures()
+    load_files(state, provider_path, provenance_path, health_path)
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        current = signatures()
+        if current != loaded:
+            load_files(state, provider_path, provenance_path, health_path)
+            loaded = current
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve a generated proxy provider over HTTP with gzip, "
+        "ETags and per-request filters (?port=, ?source=, ?top=, ?server=)"
+    )
+    parser.add_argument("provider_path", help="Provider YAML to serve")
+    parser.add_argument("--provenance", help="provenance.json for ?source= filtering")
+    parser.add_argument("--health", metavar="DB", help="Health history for ?top= latency ranking")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    state = ProviderState()
+    start_server(state, args.host, args.port, quiet=not args.verbose)
+    try:
+        watch_files(state, args.provider_path, args.provenance, args.health)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,164 @@
+import json
+import sqlite3
+import sys
+
+from fingerprint import ensure_unique_names, merge_fingerprint
+from proxy_node import to_dict
+from yaml_io import atomic_write, dump_yaml, load_yaml
+
+
+# Bumped whenever the fingerprint column changes meaning; older stores are
+# rekeyed on open
+SCHEMA_VERSION = 2
+
+
+class ProxyStore:
+    # Persistent proxy provider backed by SQLite, keyed by merge_fingerprint
+    # so distinct nodes sharing a name never overwrite each other and a node
+    # moved to another CDN front replaces its row. A merge only writes rows
+    # for proxies that are new or whose contents changed. seq keeps the
+    # original insertion order for export.
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS proxy_nodes (
+                fingerprint TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                data TEXT NOT NULL,
+                seq INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS proxy_nodes_name ON proxy_nodes (name);
+            CREATE INDEX IF NOT EXISTS proxy_nodes_seq ON proxy_nodes (seq);
+            CREATE TABLE IF NOT EXISTS store_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.rekey()
+
+    def rekey(self):
+        # Recompute every fingerprint from the stored data. Rows that now
+        # share one keep the latest data at the earliest position.
+        rows = self.db.execute(
+            "SELECT name, data, seq FROM proxy_nodes ORDER BY seq").fetchall()
+        merged = {}
+        for name, data, seq in rows:
+            fingerprint = merge_fingerprint(json.loads(data))
+            first_seq = merged[fingerprint][2] if fingerprint in merged else seq
+            merged[fingerprint] = (name, data, first_seq)
+        with self.db:
+            self.db.execute("DELETE FROM proxy_nodes")
+            self.db.executemany(
+                "INSERT INTO proxy_nodes (fingerprint, name, data, seq) VALUES (?, ?, ?, ?)",
+                ((fingerprint, *row) for fingerprint, row in merged.items()),
+            )
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM proxy_nodes").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def merge(self, proxies):
+        # Returns (added, changed) counts. Unchanged proxies cost one index
+        # lookup and no write.
+        added = 0
+        changed = 0
+        next_seq = self.db.execute(
+            "SELECT COALESCE(MAX(seq), 0) + 1 FROM proxy_nodes").fetchone()[0]
+        with self.db:
+            for proxy in proxies:
+                fingerprint = merge_fingerprint(proxy)
+                row = self.db.execute(
+                    "SELECT data FROM proxy_nodes WHERE fingerprint = ?",
+                    (fingerprint,),
+                ).fetchone()
+                if row is not None and json.loads(row[0]) == proxy:
+                    continue
+
+                data = json.dumps(to_dict(proxy), ensure_ascii=False)
+                if row is None:
+                    self.db.execute(
+                        "INSERT INTO proxy_nodes (fingerprint, name, data, seq) VALUES (?, ?, ?, ?)",
+                        (fingerprint, proxy["name"], data, next_seq),
+                    )
+                    next_seq += 1
+                    added += 1
+                else:
+                    self.db.execute(
+                        "UPDATE proxy_nodes SET name = ?, data = ? WHERE fingerprint = ?",
+                        (proxy["name"], data, fingerprint),
+                    )
+                    changed += 1
+        return added, changed
+
+    def remove(self, fingerprints):
+        # By fingerprint: export() may rename proxies, so names do not match
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM proxy_nodes WHERE fingerprint = ?",
+                ((fingerprint,) for fingerprint in fingerprints),
+            )
+
+    def retain(self, proxies):
+        # Drop every stored proxy that is not in proxies, e.g. the ones a
+        # clean run removed from the provider. Returns how many were dropped.
+        keep = {merge_fingerprint(proxy) for proxy in proxies}
+        stale = [
+            fingerprint
+            for (fingerprint,) in self.db.execute("SELECT fingerprint FROM proxy_nodes")
+            if fingerprint not in keep
+        ]
+        self.remove(stale)
+        return len(stale)
+
+    def get_meta(self, key):
+        row = self.db.execute(
+            "SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+
+    def iter_proxies(self):
+        for (data,) in self.db.execute("SELECT data FROM proxy_nodes ORDER BY seq"):
+            yield json.loads(data)
+
+    def export(self):
+        return {"proxies": ensure_unique_names(self.iter_proxies())}
+
+
+def main(argv):
+    if len(argv) != 4 or argv[2] not in ("import", "export"):
+        print("Usage: python proxy_store.py <store.db> import|export <proxies.yaml>")
+        sys.exit(1)
+
+    store_path, command, yaml_path = argv[1:]
+    with ProxyStore(store_path) as store:
+        if command == "import":
+            data = load_yaml(yaml_path) or {}
+            added, changed = store.merge(data.get("proxies") or [])
+            print(f"Imported {added} new and {changed} changed proxies into {store_path}")
+        else:
+            with atomic_write(yaml_path) as file:
+                dump_yaml(store.export(), file)
+            print(f"Exported {len(store)} proxies to {yaml_path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
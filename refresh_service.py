@@ -0,0 +1,199 @@
+import argparse
+import os
+import random
+import shutil
+import time
+from datetime import datetime
+
+import append_proxies
+import clean_proxy_provider
+import dns_cache
+import metrics
+import provider_server
+import v2raysubtoyaml
+from health_store import HealthStore
+from provider_server import ProviderState, start_server
+from yaml_io import atomic_write
+
+# Default seconds between refreshes of a source, and the +/- fraction of
+# random jitter so sources sharing a host do not fire together
+REFRESH_INTERVAL = 1800
+JITTER = 0.1
+# Shortest sleep between scheduler wakeups
+MIN_SLEEP = 5
+
+
+def log(message):
+    print(f"[{datetime.now().isoformat(timespec='seconds')}] {message}", flush=True)
+
+
+def next_due(interval, jitter):
+    return time.monotonic() + interval * (1 + random.uniform(-jitter, jitter))
+
+
+def publish_provider(canonical_path, provider_path):
+    # Merge the fresh canonical provider into the one clash-meta reads. Every
+    # write goes through atomic_write, so a refresh never exposes a
+    # half-written provider.
+    if not os.path.exists(canonical_path):
+        log(f"No canonical provider at {canonical_path}, nothing to publish")
+        return
+    if not os.path.exists(provider_path):
+        with open(canonical_path, "r") as source, atomic_write(provider_path) as target:
+            shutil.copyfileobj(source, target)
+        log(f"Created {provider_path} from {canonical_path}")
+        return
+    append_proxies.main([canonical_path], provider_path)
+
+
+def run_stage(name, func, *args):
+    # Returns (ok, result). A failing stage (including the sys.exit calls of
+    # the scripts) is logged and the service keeps running.
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except SystemExit as e:
+        log(f"{name} exited with status {e.code}")
+        return False, None
+    except Exception as e:
+        log(f"{name} failed: {e}")
+        return False, None
+    log(f"{name} finished in {time.perf_counter() - start:.1f}s")
+    return True, result
+
+
+def serve_canonical(state, canonical, health_path):
+    # Hand the converter's in-memory canonical list to the HTTP endpoint
+    proxies, provenance = canonical
+    latencies = {}
+    if health_path:
+        with HealthStore(health_path) as health:
+            latencies = health.latencies()
+    state.update(proxies, provenance, latencies)
+
+
+def refresh(due_urls, converter_args, session, args, state=None):
+    # Each cycle gets its own run report, overwriting the previous one
+    metrics.default_metrics.reset()
+    log(f"Refreshing {len(due_urls)} source(s)")
+    ok, canonical = run_stage(
+        "convert", v2raysubtoyaml.run, converter_args, due_urls, session)
+    if state is not None and ok and not canonical and not state.version:
+        # Nothing changed since the last run, but nothing is served yet
+        canonical = v2raysubtoyaml.load_canonical(converter_args.canonical_dir)
+    if state is not None and ok and canonical:
+        serve_canonical(state, canonical, args.health)
+
+    canonical_path = f"{converter_args.canonical_dir}/proxies_updated_80.yaml"
+    ok, _ = run_stage("merge", publish_provider, canonical_path, args.provider_path)
+    if ok:
+        run_stage(
+            "clean",
+            clean_proxy_provider.main,
+            args.provider_path,
+            args.log_path,
+            args.health,
+            args.min_score,
+        )
+    dns_cache.default_resolver.save()
+    metrics.write_reports(args)
+
+
+def serve(args):
+    # Scheduler loop. The requests session, DNS cache, parsed YAML sidecars
+    # and imported modules all live for the whole process instead of being
+    # rebuilt by a new interpreter every cron run.
+    urls = args.urls or v2raysubtoyaml.SUBSCRIPTION_URLS
+    intervals = {url: args.interval for url in urls}
+    for seconds, url in args.source_interval or []:
+        intervals[url] = float(seconds)
+
+    converter_argv = list(intervals)
+    if args.front_cache:
+        converter_argv += ["--front-cache", args.front_cache]
+    converter_args = v2raysubtoyaml.parse_args(converter_argv)
+    schedule = {url: 0 for url in intervals}
+    session = v2raysubtoyaml.create_session()
+
+    state = None
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        state = ProviderState()
+        server = start_server(state, host or provider_server.HOST, int(port))
+
+    try:
+        while True:
+            now = time.monotonic()
+            due_urls = [url for url, due in schedule.items() if due <= now]
+            if due_urls:
+                refresh(due_urls, converter_args, session, args, state)
+                for url in due_urls:
+                    schedule[url] = next_due(intervals[url], args.jitter)
+                if args.once:
+                    return
+            sleep_for = max(MIN_SLEEP, min(schedule.values()) - time.monotonic())
+            log(f"Next refresh in {sleep_for:.0f}s")
+            time.sleep(sleep_for)
+    except KeyboardInterrupt:
+        log("Stopping")
+    finally:
+        if state is not None:
+            server.shutdown()
+        session.close()
+        dns_cache.default_resolver.save()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Keep a proxy provider fresh: periodically refresh the "
+        "subscriptions, merge them into the provider and clean dead proxies"
+    )
+    parser.add_argument("provider_path", help="Proxy provider file clash-meta reads")
+    parser.add_argument(
+        "log_path", nargs="?",
+        help="mihomo debug log used to clean dead proxies")
+    parser.add_argument(
+        "--url", action="append", dest="urls", default=[],
+        help="Subscription url (repeatable; defaults to the built-in list)")
+    parser.add_argument(
+        "--interval", type=float, default=REFRESH_INTERVAL,
+        help="Default seconds between refreshes of each source")
+    parser.add_argument(
+        "--source-interval", nargs=2, action="append",
+        metavar=("SECONDS", "URL"),
+        help="Refresh interval for one source; unknown urls are added as sources")
+    parser.add_argument(
+        "--jitter", type=float, default=JITTER,
+        help="Random +/- fraction applied to every interval")
+    parser.add_argument(
+        "--health", metavar="DB",
+        help="Health history used when cleaning the provider")
+    parser.add_argument(
+        "--min-score", type=float, default=clean_proxy_provider.MIN_SCORE,
+        help="Health score below which a proxy is evicted")
+    parser.add_argument(
+        "--dns-cache", metavar="FILE",
+        help="Persist resolved addresses to FILE")
+    parser.add_argument(
+        "--front-cache", metavar="FILE",
+        help="Spread rewritten proxies across the fronts ranked in FILE by "
+        "front_scanner.py (re-read every refresh)")
+    parser.add_argument(
+        "--serve", metavar="[HOST:]PORT",
+        help="Also serve the canonical provider from memory over HTTP")
+    parser.add_argument(
+        "--once", action="store_true",
+        help="Run a single refresh of every source and exit")
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.dns_cache:
+        dns_cache.use_cache_file(args.dns_cache)
+    serve(args)
+
+
+if __name__ == "__main__":
+    main()
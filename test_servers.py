@@ -1,130 +1,564 @@
-import socket
-import sys
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import ssl
+import statistics
 import time
 
-import yaml
 from tqdm import tqdm
 
+import dns_cache
+import metrics
+from health_store import MIN_SCORE, HealthStore
+from proxy_node import from_dicts, proxy_host, proxy_path
+from yaml_io import load_yaml, save_provider
 
-def load_yaml(file_path):
+# Probe tuning: simultaneous connection attempts, seconds per attempt,
+# extra attempts after a failure and the pause before each retry
+CONCURRENCY = 200
+PROBE_TIMEOUT = 5
+RETRIES = 1
+RETRY_DELAY = 0.5
+
+# Latency measurements per proxy and how many of the fastest proxies go
+# into the top-K output
+SAMPLES = 1
+TOP_K = 50
+
+# Deep probe outcomes. Only PROBE_OK counts as reachable; the others say
+# which step failed: TCP connect, TLS handshake, no reply to the WebSocket
+# upgrade (timeout or connection closed), a non-101 reply, or a reply that
+# is not a valid upgrade.
+PROBE_OK = "ok"
+PROBE_UNREACHABLE = "unreachable"
+PROBE_TLS_FAILED = "tls_failed"
+PROBE_TIMEOUT_STATUS = "timeout"
+PROBE_CLOSED = "closed"
+PROBE_REJECTED = "rejected"
+PROBE_BAD_RESPONSE = "bad_response"
+# Outcomes worth another attempt; a reply from the server is final
+RETRY_STATUSES = {PROBE_UNREACHABLE, PROBE_TIMEOUT_STATUS, PROBE_CLOSED}
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+# Largest upgrade response head read before giving up on it
+MAX_RESPONSE_HEAD = 16 * 1024
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+async def connect_once(address, port, timeout, server_hostname=None):
+    # One connection attempt, with a TLS handshake when server_hostname is
+    # given. Returns the elapsed milliseconds or None on failure.
+    tls_context = CLIENT_TLS_CONTEXT if server_hostname else None
+
+    start = time.perf_counter()
     try:
-        with open(file_path, "r") as file:
-            return yaml.safe_load(file)
-    except yaml.YAMLError as e:
-        print(f"Error loading YAML file {file_path}: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Unexpected error loading file {file_path}: {e}")
-        sys.exit(1)
-
-
-def save_yaml(file_path, data):
-    if data and "proxies" in data and data["proxies"]:
-        try:
-            with open(file_path, "w") as file:
-                yaml.dump(
-                    data,
-                    file,
-                    allow_unicode=True,
-                    sort_keys=False,
-                    default_flow_style=False,
-                    indent=2,
-                )
-                print(f"Configuration has been written to {file_path}")
-        except Exception as e:
-            print(f"Error saving YAML file {file_path}: {e}")
-            sys.exit(1)
-    else:
-        print(f"No valid data to save to {file_path}")
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                address,
+                port,
+                ssl=tls_context,
+                server_hostname=server_hostname,
+            ),
+            timeout,
+        )
+    except (asyncio.TimeoutError, OSError, UnicodeError, ssl.SSLError):
+        return None
+    latency = (time.perf_counter() - start) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+    return latency
+
+
+async def probe_address(address, port, timeout, retries, server_hostname=None):
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(RETRY_DELAY)
+        latency = await connect_once(address, port, timeout, server_hostname)
+        if latency is not None:
+            return latency
+    return None
+
+
+async def probe_addresses(addresses, port, timeout, retries, server_hostname=None):
+    # Like probe_address, but each attempt falls back through every address
+    # of the host. Returns (latency, address that answered) or (None, None).
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(RETRY_DELAY)
+        for address in addresses:
+            latency = await connect_once(address, port, timeout, server_hostname)
+            if latency is not None:
+                return latency, address
+    return None, None
+
+
+async def measure_proxy(proxy, samples, timeout, retries, tls):
+    # Connect latency (and TLS handshake latency for tls proxies when tls
+    # is set) over several samples, summarised as median and p95
+    result = {
+        "proxy": proxy,
+        "latency": None,
+        "latency_p95": None,
+        "tls_latency": None,
+        "tls_latency_p95": None,
+    }
+    server_name = proxy["servername"]
+    addresses = await dns_cache.default_resolver.resolve_all_async(server_name)
+    if addresses is None:
+        return result
+
+    connect_times = []
+    tls_times = []
+    for _ in range(samples):
+        latency, address = await probe_addresses(addresses, proxy["port"], timeout, retries)
+        if latency is None:
+            continue
+        # Later samples start with the address that answered
+        addresses = [address] + [other for other in addresses if other != address]
+        connect_times.append(latency)
+        if tls and proxy.get("tls"):
+            tls_latency = await probe_address(
+                address, proxy["port"], timeout, 0, server_name)
+            if tls_latency is not None:
+                tls_times.append(tls_latency)
 
+    if connect_times:
+        result["latency"] = statistics.median(connect_times)
+        result["latency_p95"] = percentile(connect_times, 95)
+    if tls_times:
+        result["tls_latency"] = statistics.median(tls_times)
+        result["tls_latency_p95"] = percentile(tls_times, 95)
+    return result
 
-def test_server(server, port, timeout=5):
+
+def client_tls_context():
+    # Proxies routinely use self-signed or CDN certificates for other names,
+    # and clash-meta is usually run with skip-cert-verify. Nothing is
+    # verified, so no CA bundle is loaded.
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+# Shared by every probe: building a context per attempt blocks the event
+# loop and lands inside the measured latency
+CLIENT_TLS_CONTEXT = client_tls_context()
+
+
+def websocket_request(path, host, key):
+    return (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n"
+        "\r\n"
+    ).encode("utf-8")
+
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1(key.encode("ascii") + WS_GUID).digest()).decode("ascii")
+
+
+def classify_upgrade_response(head, key):
+    # Returns (status, HTTP status code or None) for the response head
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        return PROBE_BAD_RESPONSE, None
+    code = int(parts[1])
+    if code != 101:
+        return PROBE_REJECTED, code
+
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("sec-websocket-accept") != websocket_accept(key):
+        return PROBE_BAD_RESPONSE, code
+    return PROBE_OK, code
+
+
+async def read_response_head(writer, reader):
+    await writer.drain()
+    return await reader.readuntil(b"\r\n\r\n")
+
+
+async def deep_probe_once(address, port, timeout, sni=None, path=None, host=None):
+    # One protocol-level check: TCP connect, a TLS handshake with sni when
+    # it is given, then a WebSocket upgrade to path when it is given. Each
+    # step gets its own timeout. Returns a result dict with the status, the
+    # HTTP status code, the total time in milliseconds and the handshake
+    # time.
+    result = {"status": PROBE_UNREACHABLE, "code": None, "latency": None, "tls_latency": None}
+    start = time.perf_counter()
     try:
-        with socket.create_connection((server, port), timeout) as sock:
-            return True
-    except (socket.timeout, socket.error) as e:
-        if isinstance(e, socket.timeout):
-            return False
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, port, limit=MAX_RESPONSE_HEAD), timeout)
+    except (asyncio.TimeoutError, OSError, UnicodeError):
+        return result
+
+    try:
+        if sni is not None:
+            tls_start = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    writer.start_tls(CLIENT_TLS_CONTEXT, server_hostname=sni), timeout)
+            except (asyncio.TimeoutError, OSError, ssl.SSLError, UnicodeError):
+                # A cancelled start_tls leaves nothing to shut down cleanly
+                writer.transport.abort()
+                result["status"] = PROBE_TLS_FAILED
+                return result
+            result["tls_latency"] = (time.perf_counter() - tls_start) * 1000
+
+        if path is not None:
+            key = base64.b64encode(os.urandom(16)).decode("ascii")
+            writer.write(websocket_request(path, host, key))
+            try:
+                head = await asyncio.wait_for(read_response_head(writer, reader), timeout)
+            except asyncio.TimeoutError:
+                result["status"] = PROBE_TIMEOUT_STATUS
+                return result
+            except asyncio.IncompleteReadError as e:
+                result["status"] = PROBE_BAD_RESPONSE if e.partial else PROBE_CLOSED
+                return result
+            except asyncio.LimitOverrunError:
+                result["status"] = PROBE_BAD_RESPONSE
+                return result
+            except (OSError, ssl.SSLError):
+                result["status"] = PROBE_CLOSED
+                return result
+            result["status"], result["code"] = classify_upgrade_response(head, key)
+            if result["status"] != PROBE_OK:
+                return result
         else:
-            raise
-    except UnicodeError as e:
-        print(f"Error in server({server})\n{e}")
-        return False
-
-
-def remove_unreachable_proxies(proxies):
-    reachable_proxies = []
-    unreachable_proxies = []
-    results = []
-
-    with tqdm(
-        total=len(proxies),
-        unit="proxy",
-    ) as pbar:
-        for proxy in proxies:
-            server_name = proxy.get("servername")
-            port = proxy.get("port")
-            if server_name and port:
-                try:
-                    is_reachable = test_server(server_name, port)
-                except socket.error:
-                    tqdm.write("Network error occurred. Retrying...")
-                    time.sleep(5)  # Wait and retry
-                    try:
-                        is_reachable = test_server(server_name, port)
-                    except socket.error:
-                        is_reachable = False
-                if is_reachable:
-                    reachable_proxies.append(proxy)
-                else:
-                    unreachable_proxies.append(proxy)
-                results.append(
-                    (proxy.get("name"), server_name, port, is_reachable))
-                pbar.update(1)
-                time.sleep(
-                    0.5
-                )  # To simulate some delay and make the progress bar more visible
+            result["status"] = PROBE_OK
+
+        result["latency"] = (time.perf_counter() - start) * 1000
+        return result
+    finally:
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), timeout)
+        except (asyncio.TimeoutError, OSError, ssl.SSLError):
+            writer.transport.abort()
+
+
+def deep_probe_target(proxy):
+    # What clash-meta would do with the proxy: connect to server (the CDN
+    # front IP after update_proxy_server), present servername as SNI and
+    # send the ws-opts Host header
+    server = proxy.get("server") or proxy["servername"]
+    sni = None
+    if proxy.get("tls"):
+        sni = proxy.get("servername") or server
+    path = host = None
+    if proxy.get("network") == "ws":
+        path = proxy_path(proxy) or "/"
+        host = proxy_host(proxy) or proxy.get("servername") or server
+    return server, sni, path, host
+
+
+async def deep_measure_proxy(proxy, samples, timeout, retries):
+    # Deep probe over several samples. The status of the last attempt
+    # classifies the proxy; latencies are summarised over the samples that
+    # completed the whole exchange.
+    result = {
+        "proxy": proxy,
+        "status": PROBE_UNREACHABLE,
+        "code": None,
+        "latency": None,
+        "latency_p95": None,
+        "tls_latency": None,
+        "tls_latency_p95": None,
+    }
+    server, sni, path, host = deep_probe_target(proxy)
+    addresses = await dns_cache.default_resolver.resolve_all_async(server)
+    if addresses is None:
+        return result
+
+    times = []
+    tls_times = []
+    for _ in range(samples):
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(RETRY_DELAY)
+            # Only a failed TCP connect moves on to the host's next address
+            for address in addresses:
+                probe = await deep_probe_once(address, proxy["port"], timeout, sni, path, host)
+                if probe["status"] != PROBE_UNREACHABLE:
+                    break
+            if probe["status"] not in RETRY_STATUSES:
+                break
+        result["status"], result["code"] = probe["status"], probe["code"]
+        if probe["status"] != PROBE_OK:
+            break
+        times.append(probe["latency"])
+        if probe["tls_latency"] is not None:
+            tls_times.append(probe["tls_latency"])
+
+    if result["status"] == PROBE_OK:
+        result["latency"] = statistics.median(times)
+        result["latency_p95"] = percentile(times, 95)
+    if result["status"] == PROBE_OK and tls_times:
+        result["tls_latency"] = statistics.median(tls_times)
+        result["tls_latency_p95"] = percentile(tls_times, 95)
+    return result
+
+
+async def probe_proxies(
+    proxies, concurrency, timeout, retries, pbar, samples=SAMPLES, tls=False, deep=False
+):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(proxy):
+        async with semaphore:
+            if deep:
+                result = await deep_measure_proxy(proxy, samples, timeout, retries)
             else:
-                print(f"Invalid proxy configuration: {proxy}")
+                result = await measure_proxy(proxy, samples, timeout, retries, tls)
+        pbar.update(1)
+        return result
 
-    print("\nServer Test Results:")
-    for name, server_name, port, is_reachable in results:
-        status = "Reachable" if is_reachable else "Unreachable"
-        print(
-            f"- Proxy: {name}\n  server_name: {server_name}\n  Port: {port} - {status}"
-        )
+    return await asyncio.gather(*(probe(proxy) for proxy in proxies))
+
+
+def check_proxies(
+    proxies,
+    concurrency=CONCURRENCY,
+    timeout=PROBE_TIMEOUT,
+    retries=RETRIES,
+    samples=SAMPLES,
+    tls=False,
+    deep=False,
+):
+    # Probe every proxy concurrently. Returns one result dict per testable
+    # proxy in input order; "latency" is None for unreachable proxies. With
+    # deep each proxy also gets a "status" from deep_probe_once and only
+    # PROBE_OK counts as reachable.
+    testable = []
+    for proxy in proxies:
+        if proxy.get("servername") and proxy.get("port"):
+            testable.append(proxy)
+        else:
+            print(f"Invalid proxy configuration: {proxy}")
+
+    metrics.count("probe_invalid", len(proxies) - len(testable))
+    with metrics.timer("probe"), tqdm(total=len(testable), unit="proxy") as pbar:
+        results = asyncio.run(
+            probe_proxies(testable, concurrency, timeout, retries, pbar, samples, tls, deep))
+    reachable = sum(result["latency"] is not None for result in results)
+    metrics.count("probe_reachable", reachable)
+    metrics.count("probe_unreachable", len(results) - reachable)
+    if deep:
+        for result in results:
+            metrics.count(f"probe_status_{result['status']}")
+    return results
+
+
+def latency_key(result):
+    # TLS handshake time is the better signal when it was measured
+    if result["tls_latency"] is not None:
+        return result["tls_latency"]
+    return result["latency"]
+
+
+def rank_by_latency(results):
+    reachable = [result for result in results if result["latency"] is not None]
+    reachable.sort(key=latency_key)
+    return [result["proxy"] for result in reachable]
 
-    print(f"\nReachable Proxies ({len(reachable_proxies)}):")
-    for proxy in reachable_proxies:
-        proxy_name = proxy.get("name")
-        print(f"- {proxy_name}")
 
-    print(f"\nUnreachable Proxies ({len(unreachable_proxies)}):")
-    for proxy in unreachable_proxies:
-        proxy_name = proxy.get("name")
-        print(f"- {proxy_name}")
+def format_latency(result):
+    status = f"Reachable ({result['latency']:.0f} ms, p95 {result['latency_p95']:.0f} ms"
+    if result["tls_latency"] is not None:
+        status += f", TLS {result['tls_latency']:.0f} ms"
+    return status + ")"
+
+
+def format_failure(result):
+    status = result.get("status")
+    if status is None or status == PROBE_UNREACHABLE:
+        return "Unreachable"
+    if result.get("code") is not None:
+        return f"Failed ({status}, HTTP {result['code']})"
+    return f"Failed ({status})"
+
+
+def remove_unreachable_proxies(
+    proxies,
+    concurrency=CONCURRENCY,
+    timeout=PROBE_TIMEOUT,
+    retries=RETRIES,
+    verbose=True,
+    results=None,
+):
+    if results is None:
+        results = check_proxies(proxies, concurrency, timeout, retries)
+    reachable_proxies = [result["proxy"] for result in results if result["latency"] is not None]
+    unreachable_proxies = [result["proxy"] for result in results if result["latency"] is None]
+
+    if verbose:
+        lines = ["\nServer Test Results:"]
+        for result in results:
+            proxy = result["proxy"]
+            status = format_latency(result) if result["latency"] is not None else format_failure(result)
+            lines.append(
+                f"- Proxy: {proxy.get('name')}\n  server_name: {proxy['servername']}\n  Port: {proxy['port']} - {status}"
+            )
+
+        lines.append(f"\nReachable Proxies ({len(reachable_proxies)}):")
+        lines.extend(f"- {proxy.get('name')}" for proxy in reachable_proxies)
+
+        lines.append(f"\nUnreachable Proxies ({len(unreachable_proxies)}):")
+        lines.extend(f"- {proxy.get('name')}" for proxy in unreachable_proxies)
+        print("\n".join(lines))
+    else:
+        print(
+            f"\nReachable Proxies: {len(reachable_proxies)}, Unreachable Proxies: {len(unreachable_proxies)}")
 
     return reachable_proxies
 
 
-def main(proxies_path):
+def top_k_path(proxies_path, top_k):
+    stem, ext = os.path.splitext(proxies_path)
+    return f"{stem}_top{top_k}{ext or '.yaml'}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Remove unreachable proxies from a proxy provider file"
+    )
+    parser.add_argument("proxies_path", help="Proxy provider YAML file")
+    parser.add_argument(
+        "--concurrency", type=int, default=CONCURRENCY,
+        help="Maximum simultaneous connection attempts")
+    parser.add_argument(
+        "--timeout", type=float, default=PROBE_TIMEOUT,
+        help="Seconds allowed for each connection attempt")
+    parser.add_argument(
+        "--retries", type=int, default=RETRIES,
+        help="Extra attempts before a proxy counts as unreachable")
+    parser.add_argument(
+        "--samples", type=int, default=SAMPLES,
+        help="Latency measurements per proxy (median and p95 are reported)")
+    parser.add_argument(
+        "--tls", action="store_true",
+        help="Also measure the TLS handshake latency of tls proxies")
+    parser.add_argument(
+        "--deep", action="store_true",
+        help="Connect to server like clash-meta does: TLS handshake with "
+        "servername as SNI and a WebSocket upgrade to the ws-opts path and "
+        "Host; keep only proxies that complete it")
+    parser.add_argument(
+        "--sort", action="store_true",
+        help="Write reachable proxies sorted from fastest to slowest")
+    parser.add_argument(
+        "--top", type=int, default=0, metavar="K",
+        help="Also write the K fastest proxies to <proxies>_topK.yaml")
+    parser.add_argument(
+        "--health", metavar="DB",
+        help="Record results in a health history; evict by score and write "
+        "the provider in score order")
+    parser.add_argument(
+        "--min-score", type=float, default=MIN_SCORE,
+        help="Health score below which a proxy is evicted (with --health)")
+    parser.add_argument(
+        "--dns-cache", metavar="FILE",
+        help="Persist resolved addresses to FILE between runs")
+    parser.add_argument(
+        "--quiet", action="store_true",
+        help="Only print totals instead of a line per proxy")
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(
+    proxies_path,
+    concurrency=CONCURRENCY,
+    timeout=PROBE_TIMEOUT,
+    retries=RETRIES,
+    verbose=True,
+    samples=SAMPLES,
+    tls=False,
+    sort=False,
+    top_k=0,
+    health_path=None,
+    min_score=MIN_SCORE,
+    deep=False,
+):
     proxies_data = load_yaml(proxies_path)
 
     if not proxies_data or "proxies" not in proxies_data:
         print("No proxies found in the provided YAML file.")
         return
 
-    proxies = proxies_data["proxies"]
-    reachable_proxies = remove_unreachable_proxies(proxies)
+    proxies = from_dicts(proxies_data["proxies"])
+    results = check_proxies(proxies, concurrency, timeout, retries, samples, tls, deep)
+    if deep:
+        statuses = {}
+        for result in results:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        print("Deep probe: " + ", ".join(
+            f"{status} {count}" for status, count in sorted(statuses.items())))
+    reachable_proxies = remove_unreachable_proxies(
+        proxies, verbose=verbose, results=results)
+
+    if health_path:
+        with HealthStore(health_path) as health:
+            health.record_many(
+                (result["proxy"], result["latency"] is not None, result["latency"], None)
+                for result in results
+            )
+            reachable_proxies, evicted = health.rank(proxies, min_score)
+        print(f"Evicted by health score: {len(evicted)}")
+
+    if sort or top_k:
+        ranked_proxies = rank_by_latency(results)
+        if sort and not health_path:
+            reachable_proxies = ranked_proxies
+        if top_k:
+            save_provider(top_k_path(proxies_path, top_k),
+                          {"proxies": ranked_proxies[:top_k]})
 
     proxies_data["proxies"] = reachable_proxies
-    save_yaml(proxies_path, proxies_data)
+    save_provider(proxies_path, proxies_data)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python test_servers.py <proxies.yaml>")
-        sys.exit(1)
+def cli(argv=None):
+    args = parse_args(argv)
+    if args.dns_cache:
+        dns_cache.use_cache_file(args.dns_cache)
+    main(
+        args.proxies_path,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        retries=args.retries,
+        verbose=not args.quiet,
+        samples=args.samples,
+        tls=args.tls,
+        sort=args.sort,
+        top_k=args.top,
+        health_path=args.health,
+        min_score=args.min_score,
+        deep=args.deep,
+    )
+    dns_cache.default_resolver.save()
+    metrics.write_reports(args)
 
-    proxies_path = sys.argv[1]
-    main(proxies_path)
+
+if __name__ == "__main__":
+    cli()
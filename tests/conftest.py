@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# The scripts live at the top of the repository and the local stand-in
+# servers in bench/; neither is an installed package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+
+@pytest.fixture
+def fronts():
+    # A scanned front pool, as front_scanner.load_fronts returns it
+    return ["198.51.100.1", "198.51.100.2", "198.51.100.3", "198.51.100.4"]
+
+
+@pytest.fixture
+def canonical_proxies():
+    # Factory for count distinct canonical vmess+ws proxies, still on their
+    # origin hosts and without a servername
+    from proxy_node import from_dicts
+
+    def make(count):
+        return from_dicts([
+            {
+                "name": f"node {index}",
+                "server": f"host{index}.example.com",
+                "port": 80,
+                "type": "vmess",
+                "uuid": f"uuid-{index}",
+                "network": "ws",
+                "servername": "",
+                "ws-opts": {"path": "/ws", "headers": {"Host": f"host{index}.example.com"}},
+            }
+            for index in range(count)
+        ])
+
+    return make
@@ -0,0 +1,40 @@
+import append_proxies
+import v2raysubtoyaml
+from proxy_node import to_dict
+
+def rewrite(proxies, new_server):
+    return {"proxies": [v2raysubtoyaml.update_proxy_server(proxy, new_server) for proxy in proxies]}
+
+
+def test_front_changes_do_not_duplicate_the_provider(fronts, canonical_proxies):
+    proxies = canonical_proxies(71)
+    provider, _ = append_proxies.merge_many_proxies([rewrite(proxies, fronts)], {"proxies": []})
+    assert len(provider["proxies"]) == 71
+
+    # Reshuffled fronts, then the fixed fallback server
+    for new_server in (fronts[::-1], fronts[1:], v2raysubtoyaml.CDN_SERVERS[0]):
+        provider, _ = append_proxies.merge_many_proxies([rewrite(proxies, new_server)], provider)
+        assert len(provider["proxies"]) == 71
+        assert sorted(proxy["name"] for proxy in provider["proxies"]) == sorted(
+            proxy["name"] for proxy in proxies)
+
+
+def test_distinct_nodes_on_one_host_are_kept(fronts, canonical_proxies):
+    # Same host and front, different uuid: two nodes, not one that moved
+    first, second = canonical_proxies(2)
+    second = dict(second, uuid="uuid-other", server=first["server"])
+    second["ws-opts"] = first["ws-opts"]
+    provider, _ = append_proxies.merge_many_proxies(
+        [rewrite([first, second], fronts)], {"proxies": []})
+    assert len(provider["proxies"]) == 2
+
+
+def test_rewritten_proxies_match_their_canonical_original(fronts, canonical_proxies):
+    from fingerprint import merge_fingerprint
+
+    proxies = canonical_proxies(2)
+    bare = dict(to_dict(proxies[1]), servername="")
+    del bare["ws-opts"]
+    for proxy in (proxies[0], bare):
+        moved = v2raysubtoyaml.update_proxy_server(proxy, fronts[0])
+        assert merge_fingerprint(moved) == merge_fingerprint(proxy)
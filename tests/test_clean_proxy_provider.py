@@ -0,0 +1,162 @@
+import os
+
+import clean_proxy_provider
+from clean_proxy_provider import extract_inactive_proxies, load_checkpoint
+
+
+def health_line(name, alive, second=0, delay=100):
+    return (
+        f'time="2026-01-01T00:00:{second:02d}Z" level=debug msg="[Provider] proxy: {name}, '
+        f'url: http://cp.cloudflare.com, alive: {str(alive).lower()}, '
+        f'delay: {delay if alive else 0}, uid: {{{second:08x}}}"\n'
+    )
+
+
+def append(path, *lines):
+    with open(path, "a") as file:
+        file.writelines(lines)
+
+
+def test_incremental_scan_reads_only_new_lines(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    append(log_path, health_line("A", False, 1), health_line("B", True, 2))
+    assert extract_inactive_proxies(log_path) == {"A"}
+    assert load_checkpoint(log_path)["offset"] == os.path.getsize(log_path)
+
+    seen = []
+    append(log_path, health_line("A", True, 3), health_line("B", False, 4))
+    inactive = extract_inactive_proxies(
+        log_path, observe=lambda *check: seen.append(check[:2]))
+    assert inactive == {"B"}
+    assert seen == [("A", True), ("B", False)]
+    proxies = load_checkpoint(log_path)["proxies"]
+    assert proxies["A"]["last_dead"] == "2026-01-01T00:00:01Z"
+    assert proxies["A"]["last_alive"] == "2026-01-01T00:00:03Z"
+
+
+def test_partial_last_line_waits_for_its_newline(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    line = health_line("A", False, 1)
+    append(log_path, health_line("B", True, 0), line[:40])
+    assert extract_inactive_proxies(log_path) == set()
+    assert load_checkpoint(log_path)["offset"] == len(health_line("B", True, 0))
+
+    append(log_path, line[40:])
+    assert extract_inactive_proxies(log_path) == {"A"}
+
+
+def test_rotation_drops_old_verdicts(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    append(log_path, health_line("A", False, 1), health_line("B", True, 2))
+    assert extract_inactive_proxies(log_path) == {"A"}
+
+    os.rename(log_path, f"{log_path}.1")
+    append(log_path, health_line("B", True, 3))
+    assert extract_inactive_proxies(log_path) == set()
+    assert set(load_checkpoint(log_path)["proxies"]) == {"B"}
+
+
+def test_truncation_rescans_from_the_start(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    append(log_path, health_line("A", False, 1), health_line("B", False, 2))
+    assert extract_inactive_proxies(log_path) == {"A", "B"}
+
+    with open(log_path, "w") as file:
+        file.write(health_line("C", False, 3))
+    assert extract_inactive_proxies(log_path) == {"C"}
+
+
+def test_full_scan_without_checkpoint_drops_old_verdicts(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    append(log_path, health_line("A", False, 1))
+    assert extract_inactive_proxies(log_path, {"A"}) == {"A"}
+
+    os.rename(log_path, f"{log_path}.1")
+    append(log_path, health_line("B", True, 2))
+    assert extract_inactive_proxies(log_path, {"A", "B"}) == set()
+    assert clean_proxy_provider.load_checkpoint(log_path)["proxies"].keys() == {"B"}
+
+
+def empty_checkpoint():
+    return {"inode": None, "offset": 0, "proxies": {}}
+
+
+def test_reversed_scan_matches_the_forward_scan(tmp_path):
+    from synthetic import write_mihomo_log
+
+    log_path = str(tmp_path / "mihomo.log")
+    names = [f"node-{index}" for index in range(50)]
+    write_mihomo_log(log_path, names, 2000, seed=3)
+
+    forward = clean_proxy_provider.scan_log(log_path, empty_checkpoint())
+    # A name missing from the log keeps the reversed scan going to the
+    # first line, so every older opposite verdict is seen too
+    backward = clean_proxy_provider.scan_log_reversed(
+        log_path, empty_checkpoint(), names + ["missing"])
+    assert backward == forward
+
+
+def test_reversed_scan_stops_once_every_proxy_has_a_verdict(tmp_path):
+    from synthetic import write_mihomo_log
+
+    log_path = str(tmp_path / "mihomo.log")
+    names = [f"node-{index}" for index in range(10)]
+    write_mihomo_log(log_path, names, 2000, seed=3)
+
+    forward_checks = []
+    forward = clean_proxy_provider.scan_log(
+        log_path, empty_checkpoint(), lambda *check: forward_checks.append(check))
+    backward_checks = []
+    backward = clean_proxy_provider.scan_log_reversed(
+        log_path, empty_checkpoint(), names, lambda *check: backward_checks.append(check))
+
+    assert len(backward_checks) == len(names) < len(forward_checks)
+    assert backward["offset"] == forward["offset"] == os.path.getsize(log_path)
+    assert {name: state["alive"] for name, state in backward["proxies"].items()} == {
+        name: state["alive"] for name, state in forward["proxies"].items()}
+
+
+def test_reversed_scan_keeps_older_opposite_verdicts(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    append(
+        log_path,
+        health_line("A", True, 1),
+        health_line("A", False, 2),
+        health_line("B", True, 3),
+        health_line("A", True, 4),
+        health_line("A", False, 5),
+    )
+    checkpoint = clean_proxy_provider.scan_log_reversed(log_path, empty_checkpoint(), ["A", "B"])
+    assert checkpoint["proxies"]["A"] == {
+        "alive": False,
+        "last_alive": "2026-01-01T00:00:04Z",
+        "last_dead": "2026-01-01T00:00:05Z",
+    }
+    # B's verdict is on the third line, so the first two are never read
+    assert checkpoint["proxies"]["B"]["last_dead"] is None
+
+
+def test_reversed_scan_resumes_before_a_partial_line(tmp_path):
+    log_path = str(tmp_path / "mihomo.log")
+    complete = health_line("A", False, 1)
+    append(log_path, complete, health_line("A", True, 2)[:30])
+    checkpoint = clean_proxy_provider.scan_log_reversed(log_path, empty_checkpoint(), ["A"])
+    assert checkpoint["offset"] == len(complete)
+    assert checkpoint["proxies"]["A"]["alive"] is False
+
+
+def test_proxies_without_servername_keep_host_and_path(tmp_path):
+    from proxy_node import from_dicts
+
+    def proxy(name, path):
+        ws_opts = {"headers": {"Host": f"{name}.example.com"}}
+        if path:
+            ws_opts["path"] = path
+        return {"name": name, "type": "vmess", "server": "192.0.2.1", "port": 80,
+                "servername": "", "network": "ws", "ws-opts": ws_opts}
+
+    for convert in (list, from_dicts):
+        data = convert([proxy("with-path", "/ws"), proxy("no-path", None)])
+        cleaned = clean_proxy_provider.clean_proxies(data)["proxies"]
+        assert [(p["name"], p["servername"]) for p in cleaned] == [
+            ("with-path", "with-path.example.com")]
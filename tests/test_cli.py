@@ -0,0 +1,39 @@
+import cli
+import test_servers
+import v2raysubtoyaml
+from health_store import HealthStore
+from yaml_io import load_yaml
+
+
+def test_sync_with_health_evicts_by_score_not_one_probe(tmp_path, monkeypatch, canonical_proxies):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(v2raysubtoyaml, "run", lambda args: (canonical_proxies(2), {}))
+    failing = ["node 0"]
+    monkeypatch.setattr(test_servers, "check_proxies", lambda proxies, deep=False: [
+        {"proxy": proxy, "latency": None if proxy["name"] in failing else 50.0}
+        for proxy in proxies
+    ])
+    argv = ["provider.yaml", "--health", "health.db", "--probe", "--cdn-server", "192.0.2.1"]
+
+    # One failed probe leaves node 0 with too little history to evict
+    cli.sync(argv)
+    assert len(load_yaml("provider.yaml", use_cache=False)["proxies"]) == 2
+
+    for _ in range(2):
+        cli.sync(argv)
+    names = [proxy["name"] for proxy in load_yaml("provider.yaml", use_cache=False)["proxies"]]
+    assert names == ["node 1"]
+    with HealthStore("health.db") as health:
+        assert health.stats(canonical_proxies(1)[0])[:2] == (0, 3)
+
+
+def test_serve_runs_on_custom_sources_only(tmp_path, monkeypatch):
+    import refresh_service
+
+    refreshed = []
+    monkeypatch.setattr(
+        refresh_service, "refresh",
+        lambda due_urls, converter_args, *rest: refreshed.append((due_urls, converter_args.urls)))
+    url = "https://example.com/owner/repo/sub"
+    cli.main(["serve", str(tmp_path / "provider.yaml"), "--url", url, "--once"])
+    assert refreshed == [([url], [url])]
@@ -0,0 +1,87 @@
+import base64
+import json
+
+import pytest
+
+import v2raysubtoyaml
+from synthetic import vmess_subscription
+from proxy_node import proxy_path
+
+
+def vmess_node(raw):
+    return "vmess://" + base64.b64encode(raw).decode("ascii")
+
+
+def payload(**fields):
+    node = {
+        "v": "2", "ps": "node", "add": "edge.example.com", "port": 443,
+        "id": "a3482e88-686a-4a58-8126-99c9df64b7bf", "aid": 0,
+        "net": "ws", "host": "h.example.com", "path": "/ws", "tls": "tls",
+    }
+    node.update(fields)
+    return node
+
+
+@pytest.fixture
+def salvaged(monkeypatch):
+    calls = []
+    salvage = v2raysubtoyaml.salvage_vmess_json
+
+    def spy(raw_data):
+        calls.append(raw_data)
+        return salvage(raw_data)
+
+    monkeypatch.setattr(v2raysubtoyaml, "salvage_vmess_json", spy)
+    return calls
+
+
+def test_fast_path_keeps_numeric_port_and_aid(salvaged):
+    stats = v2raysubtoyaml.new_conversion_stats()
+    raw = json.dumps(payload(port=8443, aid=2)).encode("utf-8")
+    proxy = v2raysubtoyaml.convert_vmess_node(vmess_node(raw), stats)
+    assert (proxy["port"], proxy["alterId"]) == (8443, 2)
+    assert proxy["servername"] == "h.example.com"
+    assert salvaged == []
+
+
+def test_cp1251_node_is_salvaged(salvaged):
+    stats = v2raysubtoyaml.new_conversion_stats()
+    name = "Привет, это тестовый узел в Москве"
+    raw = json.dumps(payload(ps=name, port="443", aid="0"), ensure_ascii=False).encode("cp1251")
+    proxy = v2raysubtoyaml.convert_vmess_node(vmess_node(raw), stats)
+    assert len(salvaged) == 1
+    assert proxy["name"] == name
+    assert proxy["port"] == 443
+    assert stats == {"invalid_host": 0, "invalid_node": 0}
+
+
+def test_malformed_node_is_salvaged(salvaged):
+    stats = v2raysubtoyaml.new_conversion_stats()
+    text = json.dumps(payload(port="2053", aid="0"))
+    raw = (text[:-1] + ', "alterId": 0 0,}').encode("utf-8")
+    proxy = v2raysubtoyaml.convert_vmess_node(vmess_node(raw), stats)
+    assert len(salvaged) == 1
+    assert (proxy["port"], proxy_path(proxy)) == (2053, "/ws")
+
+
+def test_process_pool_matches_the_serial_conversion(monkeypatch, capsys):
+    count = v2raysubtoyaml.PARALLEL_MIN_NODES
+    body = vmess_subscription(count, seed=5, malformed_ratio=0.02, non_utf8_ratio=0.02)
+    data = base64.b64decode(body).decode("utf-8")
+
+    serial = v2raysubtoyaml.convert_v2ray_to_clash(data, 1)
+    serial_counts = capsys.readouterr().out.splitlines()[-1]
+
+    pool_calls = []
+    convert_parallel = v2raysubtoyaml.convert_parallel
+    monkeypatch.setattr(
+        v2raysubtoyaml, "convert_parallel",
+        lambda *args: pool_calls.append(args[1]) or convert_parallel(*args))
+    parallel = v2raysubtoyaml.convert_v2ray_to_clash(data, 4)
+    parallel_counts = capsys.readouterr().out.splitlines()[-1]
+
+    assert pool_calls == [4]
+    assert parallel == serial
+    assert serial_counts.startswith("Number of invalid_host")
+    assert parallel_counts == serial_counts
+    assert len(serial["proxies"]) > count * 0.9
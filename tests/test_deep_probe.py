@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import test_servers
+from servers import WS_EXPECTED, WS_PATH, WS_SERVERNAME, websocket_fleet
+
+TIMEOUT = 3
+
+
+@pytest.fixture(scope="module")
+def fleet():
+    with websocket_fleet() as listeners:
+        if not all(tls for _, _, tls in listeners):
+            pytest.skip("openssl is needed for the TLS stand-ins")
+        yield listeners
+
+
+def test_each_outcome_gets_its_status(fleet):
+    async def probe_all():
+        return await asyncio.gather(*(
+            test_servers.deep_probe_once(
+                "127.0.0.1", port, TIMEOUT, WS_SERVERNAME, WS_PATH, WS_SERVERNAME)
+            for port, _, _ in fleet
+        ))
+
+    results = asyncio.run(probe_all())
+    statuses = {kind: result["status"] for (_, kind, _), result in zip(fleet, results)}
+    assert statuses == WS_EXPECTED
+    for (_, kind, _), result in zip(fleet, results):
+        if kind == "ws":
+            assert result["code"] == 101
+            assert 0 < result["tls_latency"] <= result["latency"]
+        else:
+            assert result["latency"] is None
+
+
+def test_check_proxies_keeps_only_working_websockets(fleet):
+    proxies = [
+        {
+            "name": f"{kind}-{port}",
+            "server": "127.0.0.1",
+            "servername": WS_SERVERNAME,
+            "port": port,
+            "tls": True,
+            "network": "ws",
+            "ws-opts": {"path": WS_PATH, "headers": {"Host": WS_SERVERNAME}},
+        }
+        for port, kind, _ in fleet
+    ]
+    results = test_servers.check_proxies(proxies, timeout=TIMEOUT, retries=0, deep=True)
+    reachable = [result["proxy"]["name"] for result in results if result["latency"] is not None]
+    assert [name.split("-")[0] for name in reachable] == ["ws"]
+
+
+def test_tls_connect_once_measures_the_handshake(fleet):
+    port = next(port for port, kind, _ in fleet if kind == "ws")
+    assert asyncio.run(test_servers.connect_once("127.0.0.1", port, TIMEOUT, WS_SERVERNAME))
+    plain = next(port for port, kind, _ in fleet if kind == "plain")
+    assert asyncio.run(test_servers.connect_once("127.0.0.1", plain, TIMEOUT, WS_SERVERNAME)) is None
+
+
+def test_probes_share_one_tls_context(fleet, monkeypatch):
+    def no_new_context():
+        raise AssertionError("probes must reuse CLIENT_TLS_CONTEXT")
+
+    monkeypatch.setattr(test_servers, "client_tls_context", no_new_context)
+    monkeypatch.setattr(test_servers.ssl, "create_default_context", no_new_context)
+    port = next(port for port, kind, _ in fleet if kind == "ws")
+    result = asyncio.run(test_servers.deep_probe_once(
+        "127.0.0.1", port, TIMEOUT, WS_SERVERNAME, WS_PATH, WS_SERVERNAME))
+    assert result["status"] == test_servers.PROBE_OK
+    assert asyncio.run(test_servers.connect_once("127.0.0.1", port, TIMEOUT, WS_SERVERNAME))
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import socket
+import time
+
+import dns_cache
+import test_servers
+
+
+def listener(address):
+    sock = socket.socket()
+    sock.bind((address, 0))
+    sock.listen(16)
+    return sock
+
+
+def pinned_resolver(monkeypatch, host, addresses):
+    resolver = dns_cache.DnsCache()
+    resolver.addresses[host] = (time.time() + 60, addresses)
+    monkeypatch.setattr(dns_cache, "default_resolver", resolver)
+    return resolver
+
+
+def test_lookup_keeps_every_address(monkeypatch):
+    infos = [
+        (socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("2001:db8::1", 0, 0, 0)),
+        (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 0)),
+        (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 0)),
+    ]
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: infos)
+    assert dns_cache.DnsCache().resolve_all("dual.test") == ["2001:db8::1", "192.0.2.1"]
+
+
+def test_probes_fall_back_to_the_next_address(monkeypatch):
+    # The first record refuses connections, the second one listens
+    with listener("127.0.0.2") as sock:
+        port = sock.getsockname()[1]
+        pinned_resolver(monkeypatch, "dual.test", ["127.0.0.1", "127.0.0.2"])
+
+        latency, address = asyncio.run(
+            test_servers.probe_addresses(["127.0.0.1", "127.0.0.2"], port, 1, 0))
+        assert latency is not None and address == "127.0.0.2"
+        proxy = {"name": "dual", "servername": "dual.test", "port": port}
+        result = asyncio.run(test_servers.measure_proxy(proxy, 2, 1, 0, False))
+        assert result["latency"] is not None
+
+
+def test_old_cache_files_still_load(tmp_path):
+    cache_path = tmp_path / "dns.json"
+    cache_path.write_text(json.dumps(
+        {"addresses": {"old.test": [time.time() + 60, "192.0.2.7"]}, "hostnames": {}}))
+    assert dns_cache.DnsCache(cache_path=str(cache_path)).resolve_all("old.test") == ["192.0.2.7"]
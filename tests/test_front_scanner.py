@@ -0,0 +1,22 @@
+import ipaddress
+import random
+
+from front_scanner import expand_candidates
+
+
+def test_large_ipv6_blocks_are_sampled():
+    addresses = expand_candidates(["2606:4700::/32"], 4, random.Random(1))
+    assert len(addresses) == 4
+    network = ipaddress.ip_network("2606:4700::/32")
+    assert all(ipaddress.ip_address(address) in network for address in addresses)
+
+
+def test_small_blocks_are_expanded_whole():
+    assert expand_candidates(["192.0.2.0/30", "2001:db8::/127", "192.0.2.1"], 8) == [
+        "192.0.2.1", "192.0.2.2", "2001:db8::", "2001:db8::1"]
+
+
+def test_ipv4_samples_skip_network_and_broadcast():
+    addresses = expand_candidates(["192.0.2.0/29"], 5, random.Random(1))
+    assert len(addresses) == 5
+    assert not {"192.0.2.0", "192.0.2.7"} & set(addresses)
@@ -0,0 +1,49 @@
+import json
+import sqlite3
+
+from health_store import HealthStore
+
+
+def vmess(server, name="n1"):
+    return {
+        "name": name,
+        "server": server,
+        "port": 443,
+        "type": "vmess",
+        "uuid": "uuid-n1",
+        "servername": "n1.example.com",
+        "network": "ws",
+        "ws-opts": {"path": "/", "headers": {"Host": "n1.example.com"}},
+    }
+
+
+def test_history_follows_a_proxy_to_another_front(tmp_path):
+    with HealthStore(str(tmp_path / "health.db")) as health:
+        health.record(vmess("192.0.2.1"), True, 100)
+        health.record(vmess("192.0.2.1"), False)
+        health.record(vmess("192.0.2.7"), True, 200)
+        assert health.stats(vmess("192.0.2.7")) == (2, 1, 0.3 * 200 + 0.7 * 100)
+        assert [proxy["server"] for proxy in health.export(0)["proxies"]] == ["192.0.2.7"]
+
+
+def test_old_histories_are_rekeyed(tmp_path):
+    # A history written before merge_fingerprint, holding one node on two fronts
+    path = str(tmp_path / "health.db")
+    HealthStore(path).close()
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA user_version = 0")
+    db.executemany(
+        "INSERT INTO health VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            ("a", "n1", json.dumps(vmess("192.0.2.1")), 3, 1, 80.0,
+             "2024-01-01T00:00:00", "2024-01-01T00:00:00"),
+            ("b", "n1", json.dumps(vmess("192.0.2.7")), 2, 0, 120.0,
+             "2024-01-02T00:00:00", "2024-01-02T00:00:00"),
+        ],
+    )
+    db.commit()
+    db.close()
+
+    with HealthStore(path) as health:
+        assert health.stats(vmess("192.0.2.9")) == (5, 1, 120.0)
+        assert [proxy["server"] for proxy in health.export(0)["proxies"]] == ["192.0.2.7"]
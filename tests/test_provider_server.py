@@ -0,0 +1,77 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from provider_server import ProviderState, parse_query, start_server
+from proxy_node import from_dicts
+
+
+@pytest.mark.parametrize("top", ["0", "-1", "x"])
+def test_parse_query_rejects_bad_top(top):
+    with pytest.raises(ValueError):
+        parse_query(f"/proxies?top={top}")
+
+
+def test_bad_top_gets_a_400():
+    state = ProviderState()
+    state.update(from_dicts([{"name": "one", "type": "vmess", "server": "192.0.2.1", "port": 80}]))
+    server = start_server(state, "127.0.0.1", 0)
+    base = f"http://127.0.0.1:{server.server_address[1]}/proxies"
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{base}?top=0", timeout=5)
+        assert error.value.code == 400
+        with urllib.request.urlopen(f"{base}?top=1", timeout=5) as response:
+            assert b"name: one" in response.read()
+    finally:
+        server.shutdown()
+
+
+def test_render_racing_an_update_is_not_cached(monkeypatch):
+    import provider_server
+
+    state = ProviderState()
+    state.update(from_dicts([{"name": "old", "type": "vmess", "server": "192.0.2.1", "port": 80}]))
+    new = from_dicts([{"name": "new", "type": "vmess", "server": "192.0.2.2", "port": 80}])
+    select = provider_server.select_proxies
+
+    def select_then_update(*args):
+        selected = select(*args)
+        state.update(new)
+        return selected
+
+    monkeypatch.setattr(provider_server, "select_proxies", select_then_update)
+    query = parse_query("/proxies")
+    assert b"name: old" in state.render(query)[0]
+    monkeypatch.setattr(provider_server, "select_proxies", select)
+    assert state.version == 2
+    assert b"name: new" in state.render(query)[0]
+
+
+def test_top_ranks_canonical_proxies_by_the_provider_history(tmp_path):
+    import clean_proxy_provider
+    import v2raysubtoyaml
+    from health_store import HealthStore
+    from provider_server import select_proxies
+
+    canonical = from_dicts([
+        {"name": name, "type": "vmess", "server": f"{name}.example.com", "port": 80,
+         "uuid": f"uuid-{name}", "network": "ws", "servername": "",
+         "ws-opts": {"path": "/ws", "headers": {"Host": f"{name}.example.com"}}}
+        for name in ("slow", "fast")
+    ])
+    provider = [v2raysubtoyaml.update_proxy_server(proxy, "198.51.100.1") for proxy in canonical]
+    log_path = tmp_path / "mihomo.log"
+    log_path.write_text("".join(
+        f'time="2026-01-01T00:00:0{index}Z" level=debug msg="[Provider] proxy: {name}, '
+        f'url: http://cp.cloudflare.com, alive: true, delay: {delay}, uid: {{{index}}}"\n'
+        for index, (name, delay) in enumerate([("slow", 900), ("fast", 60)])
+    ))
+
+    with HealthStore(str(tmp_path / "health.db")) as health:
+        clean_proxy_provider.clean_proxies(provider, str(log_path), health, 0)
+        latencies = health.latencies()
+    assert sorted(latencies.values()) == [60, 900]
+    top = select_proxies(canonical, {}, latencies, top=1)
+    assert [proxy["name"] for proxy in top] == ["fast"]
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+
+import append_proxies
+from proxy_store import ProxyStore
+from yaml_io import dump_yaml, load_yaml, save_provider
+
+
+def vmess(name, server):
+    return {
+        "name": name,
+        "server": server,
+        "port": 443,
+        "type": "vmess",
+        "uuid": f"uuid-{name}",
+        "alterId": 0,
+        "cipher": "auto",
+        "tls": True,
+        "skip-cert-verify": True,
+        "servername": f"{name}.example.com",
+        "network": "ws",
+        "ws-opts": {"path": "/", "headers": {"Host": f"{name}.example.com"}},
+        "udp": True,
+    }
+
+
+def write(path, proxies):
+    with open(path, "w") as file:
+        dump_yaml({"proxies": proxies}, file)
+
+
+def names(path):
+    return [proxy["name"] for proxy in load_yaml(path, use_cache=False)["proxies"]]
+
+
+def test_cleaned_proxies_do_not_come_back(tmp_path):
+    provider = str(tmp_path / "provider.yaml")
+    store = str(tmp_path / "proxies.db")
+    first = str(tmp_path / "first.yaml")
+    second = str(tmp_path / "second.yaml")
+    write(first, [vmess("n1", "192.0.2.1"), vmess("n2", "192.0.2.2")])
+    write(second, [vmess("n3", "192.0.2.3")])
+
+    append_proxies.main_store([first], provider, store)
+    assert names(provider) == ["n1", "n2"]
+
+    # A clean run drops n1 from the provider only
+    data = load_yaml(provider, use_cache=False)
+    data["proxies"] = [proxy for proxy in data["proxies"] if proxy["name"] != "n1"]
+    save_provider(provider, data)
+
+    append_proxies.main_store([second], provider, store)
+    assert names(provider) == ["n2", "n3"]
+    with ProxyStore(store) as proxy_store:
+        assert len(proxy_store) == 2
+
+
+def test_remove_matches_renamed_proxies(tmp_path):
+    # Distinct nodes sharing a name are exported as "n1" and "n1 2"
+    with ProxyStore(str(tmp_path / "proxies.db")) as store:
+        other = dict(vmess("n1", "192.0.2.9"), uuid="uuid-other")
+        store.merge([vmess("n1", "192.0.2.1"), other])
+        exported = store.export()["proxies"]
+        assert [proxy["name"] for proxy in exported] == ["n1", "n1 2"]
+        assert store.retain(exported[:1]) == 1
+        assert [proxy["name"] for proxy in store.export()["proxies"]] == ["n1"]
+
+
+def test_moved_front_replaces_the_stored_proxy(tmp_path):
+    with ProxyStore(str(tmp_path / "proxies.db")) as store:
+        store.merge([vmess("n1", "192.0.2.1"), vmess("n2", "192.0.2.1")])
+        assert store.merge([vmess("n1", "192.0.2.7")]) == (0, 1)
+        assert [proxy["server"] for proxy in store.export()["proxies"]] == [
+            "192.0.2.7", "192.0.2.1"]
+
+
+def test_old_stores_are_rekeyed(tmp_path):
+    # A store written before merge_fingerprint, holding one node on two fronts
+    path = str(tmp_path / "proxies.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE proxy_nodes (fingerprint TEXT PRIMARY KEY, name TEXT NOT NULL, "
+        "data TEXT NOT NULL, seq INTEGER NOT NULL)")
+    db.executemany(
+        "INSERT INTO proxy_nodes VALUES (?, ?, ?, ?)",
+        [
+            ("a", "n1", json.dumps(vmess("n1", "192.0.2.1")), 1),
+            ("b", "n2", json.dumps(vmess("n2", "192.0.2.1")), 2),
+            ("c", "n1 2", json.dumps(dict(vmess("n1", "192.0.2.7"), name="n1 2")), 3),
+        ],
+    )
+    db.commit()
+    db.close()
+
+    with ProxyStore(path) as store:
+        exported = store.export()["proxies"]
+        assert [(proxy["name"], proxy["server"]) for proxy in exported] == [
+            ("n1 2", "192.0.2.7"), ("n2", "192.0.2.1")]
+        assert store.merge(exported) == (0, 0)
+
+
+def test_unchanged_provider_is_not_reread(tmp_path, monkeypatch):
+    provider = str(tmp_path / "provider.yaml")
+    store = str(tmp_path / "proxies.db")
+    first = str(tmp_path / "first.yaml")
+    second = str(tmp_path / "second.yaml")
+    write(first, [vmess("n1", "192.0.2.1")])
+    write(second, [vmess("n2", "192.0.2.2")])
+    append_proxies.main_store([first], provider, store)
+
+    loaded = []
+    real_load_yaml = append_proxies.load_yaml
+    monkeypatch.setattr(
+        append_proxies, "load_yaml", lambda path: loaded.append(path) or real_load_yaml(path))
+    append_proxies.main_store([second], provider, store)
+    assert loaded == [second]
+    assert names(provider) == ["n1", "n2"]
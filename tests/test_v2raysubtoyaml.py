@@ -0,0 +1,159 @@
+import base64
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+import v2raysubtoyaml
+
+URL = "https://example.com/owner/repo/sub"
+
+
+def vmess_link(name, port):
+    node = {
+        "v": "2", "ps": name, "add": "edge.example.com", "port": str(port),
+        "id": "a3482e88-686a-4a58-8126-99c9df64b7bf", "aid": "0",
+        "net": "ws", "type": "none", "host": "h.example.com", "path": "/ws", "tls": "",
+    }
+    return "vmess://" + base64.b64encode(json.dumps(node).encode()).decode()
+
+
+BODY = base64.b64encode(
+    "\n".join([vmess_link("one", 80), vmess_link("two", 443)]).encode())
+
+
+class Response:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"ETag": '"v1"'}
+
+    def iter_content(self, size):
+        for start in range(0, len(self.content), size):
+            yield self.content[start:start + size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Session:
+    # Serves BODY once, then answers conditional requests with 304
+    def get(self, url, headers=None, **kwargs):
+        if headers and headers.get("If-None-Match") == '"v1"':
+            return Response(304)
+        return Response(200, BODY)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_unchanged_sources_skip_the_canonical_rebuild(tmp_path, monkeypatch, stream):
+    monkeypatch.chdir(tmp_path)
+    argv = [URL, "--workers", "1"] + (["--stream"] if stream else [])
+    args = v2raysubtoyaml.parse_args(argv)
+
+    proxies, _ = v2raysubtoyaml.run(args, session=Session())
+    assert len(proxies) == 2
+    written = {
+        name: os.stat(tmp_path / "canonical" / name).st_mtime_ns
+        for name in os.listdir(tmp_path / "canonical")
+    }
+
+    assert v2raysubtoyaml.run(args, session=Session()) is None
+    for name, mtime in written.items():
+        assert os.stat(tmp_path / "canonical" / name).st_mtime_ns == mtime
+
+    proxies, provenance = v2raysubtoyaml.load_canonical()
+    assert [proxy["name"] for proxy in proxies] == list(provenance)
+
+
+def test_changed_sinks_rebuild_the_canonical_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    v2raysubtoyaml.run(v2raysubtoyaml.parse_args([URL]), session=Session())
+
+    args = v2raysubtoyaml.parse_args([URL, "--cdn-server", "192.0.2.1"])
+    proxies, _ = v2raysubtoyaml.run(args, session=Session())
+    assert len(proxies) == 2
+
+
+def test_writer_leaves_nothing_behind_on_error(tmp_path):
+    path = tmp_path / "proxies.yaml"
+    with pytest.raises(KeyError):
+        with v2raysubtoyaml.ProxyYamlWriter(str(path)) as writer:
+            writer.write({"name": "one", "port": 80})
+            raise KeyError("server")
+    assert os.listdir(tmp_path) == []
+
+    with v2raysubtoyaml.ProxyYamlWriter(str(path)) as writer:
+        writer.write({"name": "one", "port": 80})
+    assert os.listdir(tmp_path) == ["proxies.yaml"]
+    assert path.read_text() == "proxies:\n- {name: one, port: 80}\n"
+
+
+def test_front_assignment_ignores_order(fronts, canonical_proxies):
+    proxies = canonical_proxies(200)
+    assigned = [v2raysubtoyaml.pick_front(proxy, fronts) for proxy in proxies]
+    assert assigned == [v2raysubtoyaml.pick_front(proxy, fronts[::-1]) for proxy in proxies]
+    assert set(assigned) == set(fronts)
+
+    # Dropping a front only moves the proxies that were on it
+    moved = [
+        before for proxy, before in zip(proxies, assigned)
+        if v2raysubtoyaml.pick_front(proxy, fronts[1:]) != before
+    ]
+    assert moved and set(moved) == {fronts[0]}
+
+
+class FlakySession:
+    # 200 for every url except those containing "broken", which raise like
+    # a dropped connection. Tracks the concurrent requests per host.
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+
+    def get(self, url, headers=None, **kwargs):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+        try:
+            time.sleep(self.delay)
+            if "broken" in url:
+                raise ConnectionError(f"connection reset by {host}")
+            return Response(200, BODY)
+        finally:
+            with self.lock:
+                self.active[host] -= 1
+
+
+def test_a_failing_source_does_not_sink_the_others(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    urls = [
+        "https://a.example.com/owner/repo/one",
+        "https://b.example.com/owner/repo/broken",
+        "https://c.example.com/owner/repo/two",
+    ]
+    results = v2raysubtoyaml.fetch_subscriptions(urls, use_cache=False, session=FlakySession())
+    assert [result["url"] for result in results] == urls
+    assert "connection reset" in results[1]["error"]
+    assert results[1]["data"] is None
+    for result in (results[0], results[2]):
+        assert result["error"] is None
+        assert "vmess://" in result["data"]
+
+
+def test_per_host_limit_bounds_concurrent_requests():
+    session = FlakySession()
+    urls = [f"https://a.example.com/owner/repo/{index}" for index in range(6)]
+    urls += [f"https://b.example.com/owner/repo/{index}" for index in range(6)]
+    results = v2raysubtoyaml.map_subscriptions(
+        lambda url, session: session.get(url).status_code, urls,
+        max_workers=12, per_host=2, session=session)
+    assert results == [200] * 12
+    assert session.peak == {"a.example.com": 2, "b.example.com": 2}
@@ -0,0 +1,16 @@
+from yaml_io import dump_yaml, load_yaml, save_provider
+
+
+def test_emoji_names_stay_readable(tmp_path):
+    path = str(tmp_path / "provider.yaml")
+    proxies = [{"name": "🇺🇸 US 01", "server": "192.0.2.1", "port": 443}]
+    save_provider(path, {"proxies": proxies})
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    assert "🇺🇸 US 01" in text
+    assert "\\U0001F1FA" not in text
+    assert load_yaml(path, use_cache=False)["proxies"] == proxies
+
+
+def test_flow_style_entries_stay_readable():
+    assert "🇯🇵" in dump_yaml({"name": "🇯🇵 JP"}, flow_style=True)
@@ -1,168 +1,527 @@
+import argparse
 import base64
+import binascii
+import hashlib
 import json
 import os
 import re
-import socket
-import sys
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlparse
 
-import chardet
-import requests
 import yaml
 
+import dns_cache
+import metrics
+from fingerprint import diff_proxies, ensure_unique_names, proxy_fingerprint
+from proxy_node import ProxyNode, copy_proxy, from_dicts
+from yaml_io import NO_WRAP, atomic_write, dump_yaml, parse_yaml, save_provider
+
+SUBSCRIPTION_URLS = [
+    "https://raw.githubusercontent.com/barry-far/V2ray-Configs/main/Splitted-By-Protocol/vmess.txt",
+    "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_base64_Sub.txt",
+    "https://raw.githubusercontent.com/resasanian/Mirza/main/vmess",
+    "https://raw.githubusercontent.com/aiboboxx/v2rayfree/main/v2",
+]
+
+# Fetch tuning: total worker threads, simultaneous requests per host and
+# per-request timeout in seconds
+MAX_WORKERS = 8
+PER_HOST_LIMIT = 2
+REQUEST_TIMEOUT = 30
+
+# Conditional GET validators, stored next to each proxies/<base>/ output
+HTTP_CACHE_FILE = "http_cache.json"
+
+# Size of the network reads fed into the streaming decoder
+STREAM_CHUNK_SIZE = 64 * 1024
+BASE64_NOISE = re.compile(rb"[^A-Za-z0-9+/=]")
+
+# Process-pool conversion: nodes per batch, and below how many nodes the
+# pool startup costs more than it saves
+CONVERT_BATCH_SIZE = 2000
+PARALLEL_MIN_NODES = 5000
+
+# Default output sinks: proxies split by these ports, plus a copy of each
+# split with server rewritten to every CDN front address
+OUTPUT_PORTS = [80, 443]
+CDN_SERVERS = ["104.26.6.171"]
+# Fronts taken from a front_scanner.py cache when one is given
+FRONTS = 4
+
+# Deduplicated provider built from every source, with the list of sources
+# that contained each proxy
+CANONICAL_DIR = "canonical"
+PROVENANCE_FILE = "provenance.json"
+# The sinks the canonical files were last written with, so a rebuild is
+# only skipped when the outputs would come out the same
+SINKS_FILE = ".sinks.json"
+
 
 def contains_letters(s):
     return bool(re.search("[a-zA-Z]", s))
 
 
 def get_hostname(ip_address):
+    return dns_cache.default_resolver.reverse(ip_address)
+
+
+def create_session(pool_size=MAX_WORKERS):
+    # One keep-alive connection pool shared by every fetch worker. requests
+    # is imported here, not at module level, so converting a local file
+    # never pays for it.
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http_cache_path(url):
     try:
-        hostname, alias, _ = socket.gethostbyaddr(ip_address)
-        return hostname
-    except socket.herror as e:
-        print(f"Could not resolve hostname for IP {ip_address}: {e}")
-        return None
-    except Exception as e:
-        print(
-            f"An error occurred while resolving hostname for IP {ip_address}: {e}")
+        return Path(f"proxies/{get_base_filename(url)}") / HTTP_CACHE_FILE
+    except ValueError:
         return None
 
 
-def decode_v2ray_subscription(url):
+def load_http_cache(url):
+    cache_path = http_cache_path(url)
+    if cache_path is None or not cache_path.exists():
+        return None
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            decoded_data = base64.b64decode(response.text).decode("utf-8")
-            return decoded_data
-        else:
-            raise Exception(
-                f"Failed to fetch V2Ray subscription from {url}. Status code: {response.status_code}"
-            )
-    except requests.exceptions.SSLError as e:
-        print(
-            f"SSL error occurred while fetching V2Ray subscription from {url}: {e}")
-        print("Check your internet connection\n")
-        sys.exit(1)
-    except requests.exceptions.RequestException as e:
-        print(
-            f"An error occurred while fetching V2Ray subscription from {url}: {e}")
-        sys.exit(1)
+        with open(cache_path, "r") as file:
+            return json.load(file).get(url)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable HTTP cache {cache_path}: {e}")
+        return None
+
+
+def save_http_cache(url, cache_entry):
+    cache_path = http_cache_path(url)
+    if cache_path is None or not cache_entry:
+        return
+
+    cache = {}
+    if cache_path.exists():
+        try:
+            with open(cache_path, "r") as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            cache = {}
+    cache[url] = cache_entry
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(cache_path) as file:
+        json.dump(cache, file, indent=2)
+
+
+def conditional_headers(cache_entry):
+    headers = {}
+    if cache_entry:
+        if cache_entry.get("etag"):
+            headers["If-None-Match"] = cache_entry["etag"]
+        if cache_entry.get("last_modified"):
+            headers["If-Modified-Since"] = cache_entry["last_modified"]
+    return headers
+
+
+def fetch_subscription(url, session=None, timeout=REQUEST_TIMEOUT, cache_entry=None):
+    # Returns (decoded_data, cache_entry). decoded_data is None when the
+    # source is unchanged since cache_entry was recorded.
+    import requests
+
+    http = session if session is not None else requests
+    with metrics.timer("fetch"):
+        response = http.get(
+            url, headers=conditional_headers(cache_entry), timeout=timeout)
+    metrics.count("fetch_bytes", len(response.content))
+    if response.status_code == 304 and cache_entry:
+        metrics.count("sources_not_modified")
+        return None, cache_entry
+    if response.status_code == 200:
+        new_entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": hashlib.sha256(response.content).hexdigest(),
+        }
+        if cache_entry and cache_entry.get("sha256") == new_entry["sha256"]:
+            metrics.count("sources_not_modified")
+            return None, new_entry
+        with metrics.timer("decode"):
+            decoded_data = base64.b64decode(response.content).decode("utf-8")
+        return decoded_data, new_entry
+    raise Exception(
+        f"Failed to fetch V2Ray subscription from {url}. Status code: {response.status_code}"
+    )
+
+
+def map_subscriptions(
+    func,
+    urls,
+    max_workers=MAX_WORKERS,
+    per_host=PER_HOST_LIMIT,
+    session=None,
+):
+    # Run func(url, session) for every url on a bounded thread pool sharing
+    # one connection pool, with at most per_host calls per host at a time.
+    # A long-running caller can pass its own session to keep connections
+    # alive between runs. Results keep url order.
+    host_limits = {}
+    for url in urls:
+        host_limits.setdefault(
+            urlparse(url).netloc, threading.BoundedSemaphore(per_host))
+
+    def run(url):
+        with host_limits[urlparse(url).netloc]:
+            return func(url, session)
+
+    workers = max(1, min(max_workers, len(urls)))
+    with ExitStack() as stack:
+        if session is None:
+            session = stack.enter_context(create_session(workers))
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+        return list(executor.map(run, urls))
+
+
+def fetch_subscriptions(
+    urls,
+    max_workers=MAX_WORKERS,
+    per_host=PER_HOST_LIMIT,
+    timeout=REQUEST_TIMEOUT,
+    use_cache=True,
+    session=None,
+):
+    # Download every subscription in parallel. A failing source becomes an
+    # error result instead of aborting the whole run.
+    def fetch(url, session):
+        result = {"url": url, "data": None, "error": None,
+                  "not_modified": False, "cache": None}
+        cache_entry = load_http_cache(url) if use_cache else None
+        try:
+            data, result["cache"] = fetch_subscription(
+                url, session, timeout, cache_entry)
+        except Exception as e:
+            result["error"] = str(e)
+            return result
+        result["data"] = data
+        result["not_modified"] = data is None
+        return result
+
+    return map_subscriptions(fetch, urls, max_workers, per_host, session)
+
+
+def iter_base64_decode(chunks):
+    # Decode a base64 body chunk by chunk, carrying the incomplete quantum
+    # over to the next chunk
+    pending = b""
+    for chunk in chunks:
+        pending += BASE64_NOISE.sub(b"", chunk)
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield base64.b64decode(pending[:usable])
+            pending = pending[usable:]
+    if pending:
+        yield base64.b64decode(pending + b"=" * (-len(pending) % 4))
+
+
+def decode_subscription_file(file_path):
+    # A saved subscription, either still base64 encoded or already decoded
+    with open(file_path, "rb") as file:
+        data = file.read()
+    if b"://" not in data:
+        data = b"".join(iter_base64_decode([data]))
+    return data.decode("utf-8", errors="ignore")
+
+
+def iter_lines(chunks):
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8", errors="ignore").strip()
+    if pending:
+        yield pending.decode("utf-8", errors="ignore").strip()
 
 
 def clean_json_string(json_string):
     # Use a regex to find all key-value pairs where the value is quoted
     pattern = r'"([^"]*)"\s*:\s*"([^"]*)"'
     matches = re.findall(pattern, json_string)
-    
+
     # Reconstruct a cleaned JSON string
     cleaned_data = "{" + ", ".join([f'"{key}": "{value}"' for key, value in matches]) + "}"
     return cleaned_data
 
-def convert_v2ray_to_clash(decoded_data):
-    v2ray_nodes = decoded_data.strip().split("\n")
-    clash_config = {"proxies": []}
-    invalid_host = []
-    invalid_node = []
 
-    for node in v2ray_nodes:
-        if node.startswith("vmess://"):
-            raw_data = base64.b64decode(node[8:])
-            result = chardet.detect(raw_data)
-            encoding = result["encoding"]
-            
-            # Decode while ignoring any errors
-            node_data = raw_data.decode(encoding, errors='ignore')
-            
-            # Clean the JSON string before loading
-            cleaned_data = clean_json_string(node_data)
-
-            try:
-                node_json = json.loads(cleaned_data)
-                server = node_json.get("add", "unknown")
-                port = int(node_json.get("port", 443))
-                host = node_json.get("host", "")
-
-                # If host is empty, use server instead and check if host is valid
-                if not host and contains_letters(server):
-                    host = server
-                elif "." not in host:
-                    invalid_host.append(host)
-                    continue
-
-                clash_node = {
-                    "name": node_json.get("ps", "Unnamed"),
-                    "server": server,
-                    "port": port,
-                    "type": node[:5],
-                    "uuid": node_json.get("id", ""),
-                    "alterId": int(node_json.get("aid", 0)),
-                    "cipher": node_json.get("cipher", "auto"),
-                    "tls": node_json.get("tls", "") == "tls",
-                    "skip-cert-verify": node_json.get("skip-cert-verify", True),
-                    "servername": host,  # Use host as servername
-                    "network": node_json.get("net", "tcp"),
-                    "ws-opts": {
-                        "path": node_json.get("path", "/"),
-                        "headers": {"Host": host},
-                    },
-                    "udp": node_json.get("udp", True),
-                }
-                clash_config["proxies"].append(clash_node)
-            except json.JSONDecodeError as e:
-                print(f"Failed to decode JSON: {cleaned_data}")
-                print(e)
-                invalid_node.append(node)
-            except KeyError as e:
-                print(f"Missing key {e} in node: {cleaned_data}")
-                invalid_node.append(node)
+def salvage_vmess_json(raw_data):
+    # Slow path for malformed nodes: guess the charset, then rebuild the
+    # JSON from its quoted key-value pairs
+    import chardet
 
-    print(
-        f"Number of invalid_host: {len(invalid_host)}, Number of invalid_node: {len(invalid_node)}")
-    return clash_config
+    encoding = chardet.detect(raw_data)["encoding"] or "utf-8"
 
+    # Decode while ignoring any errors
+    node_data = raw_data.decode(encoding, errors='ignore')
 
-def filter_proxies_by_port(config, port):
-    filtered_proxies = [
-        proxy for proxy in config["proxies"] if proxy.get("port") == port
-    ]
-    return {"proxies": filtered_proxies}
+    # Clean the JSON string before loading
+    cleaned_data = clean_json_string(node_data)
+    return json.loads(cleaned_data), cleaned_data
 
 
-def update_server(config, new_server):
-    for proxy in config["proxies"]:
-        original_server_name = proxy["servername"]
-        if not original_server_name:
-            original_server = proxy["server"]
-            proxy["servername"] = original_server
-        proxy["server"] = new_server
-    return config
+def decode_vmess_json(raw_data):
+    # Fast path: almost every node is strict UTF-8 JSON
+    try:
+        node_json = json.loads(raw_data.decode("utf-8"))
+        if isinstance(node_json, dict):
+            return node_json, None
+    except ValueError:
+        pass
+    return salvage_vmess_json(raw_data)
 
 
-def save_yaml(file_path, data):
-    if not data or not data.get("proxies"):
-        print(f"No data to save for {file_path}")
-        return
+def new_conversion_stats():
+    return {"invalid_host": 0, "invalid_node": 0}
+
+
+def print_conversion_stats(stats):
+    metrics.count("nodes_invalid_host", stats["invalid_host"])
+    metrics.count("nodes_invalid_node", stats["invalid_node"])
+    print(
+        f"Number of invalid_host: {stats['invalid_host']}, Number of invalid_node: {stats['invalid_node']}")
+
 
+def convert_vmess_node(node, stats):
+    payload = node[8:].strip()
     try:
-        with open(file_path, "w") as file:
-            yaml.dump(
-                data,
-                file,
-                allow_unicode=True,
-                sort_keys=False,
-                default_flow_style=True,
-            )
-            print(f"Configuration has been written to {file_path}")
-    except Exception as e:
-        print(f"Error saving YAML file {file_path}: {e}")
-        sys.exit(1)
+        raw_data = base64.b64decode(payload + "=" * (-len(payload) % 4))
+    except (binascii.Error, ValueError) as e:
+        print(f"Failed to decode base64 node: {node[:60]}")
+        print(e)
+        stats["invalid_node"] += 1
+        return None
+
+    cleaned_data = None
+    try:
+        node_json, cleaned_data = decode_vmess_json(raw_data)
+        server = node_json.get("add", "unknown")
+        port = int(node_json.get("port", 443))
+        host = node_json.get("host") or ""
+
+        # If host is empty, use server instead and check if host is valid
+        if not host and contains_letters(server):
+            host = server
+        elif "." not in host:
+            stats["invalid_host"] += 1
+            return None
+
+        return ProxyNode(
+            name=node_json.get("ps", "Unnamed"),
+            server=server,
+            port=port,
+            type=node[:5],
+            uuid=node_json.get("id", ""),
+            alter_id=int(node_json.get("aid", 0)),
+            cipher=node_json.get("cipher", "auto"),
+            tls=node_json.get("tls", "") == "tls",
+            skip_cert_verify=node_json.get("skip-cert-verify", True),
+            servername=host,  # Use host as servername
+            network=node_json.get("net", "tcp"),
+            ws_path=node_json.get("path", "/"),
+            ws_host=host,
+            udp=node_json.get("udp", True),
+        )
+    except json.JSONDecodeError as e:
+        print(f"Failed to decode JSON: {cleaned_data}")
+        print(e)
+        stats["invalid_node"] += 1
+    except KeyError as e:
+        print(f"Missing key {e} in node: {cleaned_data or raw_data}")
+        stats["invalid_node"] += 1
+    except (TypeError, ValueError) as e:
+        print(f"Invalid value in node: {cleaned_data or raw_data}")
+        print(e)
+        stats["invalid_node"] += 1
+    return None
+
+
+def iter_clash_proxies(v2ray_nodes, stats):
+    for node in v2ray_nodes:
+        if node.startswith("vmess://"):
+            clash_node = convert_vmess_node(node, stats)
+            if clash_node is not None:
+                yield clash_node
+
+
+def convert_batch(v2ray_nodes):
+    stats = new_conversion_stats()
+    return list(iter_clash_proxies(v2ray_nodes, stats)), stats
+
+
+def convert_parallel(v2ray_nodes, workers, batch_size=CONVERT_BATCH_SIZE):
+    # Shard the nodes into batches converted on a process pool. map keeps
+    # batch order, so proxies come back in subscription order.
+    batches = [
+        v2ray_nodes[start:start + batch_size]
+        for start in range(0, len(v2ray_nodes), batch_size)
+    ]
+    proxies = []
+    stats = new_conversion_stats()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch_proxies, batch_stats in executor.map(convert_batch, batches):
+            proxies.extend(batch_proxies)
+            for key, count in batch_stats.items():
+                stats[key] += count
+    return proxies, stats
+
+
+def convert_v2ray_to_clash(decoded_data, workers=1):
+    # workers: 1 converts in this process, 0 uses every CPU. Small inputs
+    # always convert serially.
+    v2ray_nodes = decoded_data.strip().split("\n")
+    workers = workers or os.cpu_count() or 1
+    with metrics.timer("convert"):
+        if workers > 1 and len(v2ray_nodes) >= PARALLEL_MIN_NODES:
+            proxies, stats = convert_parallel(v2ray_nodes, workers)
+        else:
+            proxies, stats = convert_batch(v2ray_nodes)
+    metrics.count("nodes_converted", len(proxies))
+    print_conversion_stats(stats)
+    return {"proxies": proxies}
+
+
+def iter_proxies_by_port(proxies, port):
+    return (proxy for proxy in proxies if proxy.get("port") == port)
+
+
+def pick_front(proxy, new_server):
+    # new_server is one address or a list of front addresses. The front is
+    # picked by rendezvous hashing of the proxy fingerprint against each
+    # address: the order of the list does not matter, and a front joining or
+    # leaving the list only moves the proxies that land on or left it.
+    if isinstance(new_server, str):
+        return new_server
+    fingerprint = proxy_fingerprint(proxy)
+    return max(
+        sorted(set(new_server)),
+        key=lambda front: hashlib.sha1(f"{fingerprint}\x1f{front}".encode("utf-8")).digest(),
+    )
+
+
+def update_proxy_server(proxy, new_server):
+    # A copy of proxy pointed at a CDN front; the original host moves to
+    # servername unless one is already set
+    updated = copy_proxy(proxy)
+    if not updated["servername"]:
+        updated["servername"] = updated["server"]
+    updated["server"] = pick_front(proxy, new_server)
+    return updated
+
+
+class ProxyYamlWriter:
+    # Writes a provider file one proxy at a time so the full list never has
+    # to be held in memory. Output goes through atomic_write, replacing
+    # file_path on a clean close; nothing is written when no proxy arrives.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.output = None
+        self.file = None
+        self.count = 0
+
+    def write(self, proxy):
+        if self.file is None:
+            self.output = atomic_write(self.file_path)
+            self.file = self.output.__enter__()
+            self.file.write("proxies:\n")
+        entry = dump_yaml(proxy, flow_style=True, width=NO_WRAP)
+        self.file.write(f"- {entry}")
+        self.count += 1
+
+    def close(self):
+        if self.file is None:
+            print(f"No data to save for {self.file_path}")
+            return
+        self.file = None
+        self.output.__exit__(None, None, None)
+        print(f"Configuration has been written to {self.file_path}")
+
+    def discard(self, exc=None):
+        # atomic_write removes its temporary file when an exception is
+        # thrown into it
+        if self.file is not None:
+            self.file = None
+            exc = exc or RuntimeError(f"{self.file_path} discarded")
+            self.output.__exit__(type(exc), exc, exc.__traceback__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard(exc)
+
+
+def build_sinks(ports=None, new_servers=None):
+    # A sink is one output file: the proxies matching its port (all proxies
+    # when port is None), with server rewritten when server is set. The
+    # first CDN server keeps the plain proxies_updated_<port>.yaml name; it
+    # may be a list of fronts that the proxies are spread across.
+    ports = OUTPUT_PORTS if ports is None else ports
+    new_servers = CDN_SERVERS if new_servers is None else new_servers
+
+    sinks = [{"file": "proxies.yaml", "port": None, "server": None}]
+    for port in ports:
+        sinks.append(
+            {"file": f"proxies_port_{port}.yaml", "port": port, "server": None})
+    for port in ports:
+        for index, server in enumerate(new_servers):
+            suffix = f"_{server}" if index else ""
+            sinks.append({
+                "file": f"proxies_updated_{port}{suffix}.yaml",
+                "port": port,
+                "server": server,
+            })
+    return sinks
+
+
+def write_outputs(folder_name_base, proxies, sinks=None):
+    # Single pass over proxies: each one is classified once by port and
+    # written to every matching sink. Rewritten variants are copies, so the
+    # original dicts and the plain outputs are never modified.
+    if sinks is None:
+        sinks = build_sinks()
+
+    written = 0
+    with ExitStack() as stack:
+        routes = {}
+        for sink in sinks:
+            writer = stack.enter_context(
+                ProxyYamlWriter(f"{folder_name_base}/{sink['file']}"))
+            routes.setdefault(sink["port"], []).append((writer, sink["server"]))
+        catch_all = routes.pop(None, [])
+
+        for proxy in proxies:
+            written += 1
+            for writer, new_server in catch_all + routes.get(proxy["port"], []):
+                if new_server:
+                    writer.write(update_proxy_server(proxy, new_server))
+                else:
+                    writer.write(proxy)
+    return written
 
 
 def load_existing_proxies(filename):
     if os.path.exists(filename):
         try:
-            with open(filename, "r") as file:
-                return yaml.safe_load(file)
+            return parse_yaml(filename)
         except yaml.YAMLError as e:
             print(f"Error reading YAML file {filename}: {e}")
             return {"proxies": []}
@@ -171,23 +530,16 @@ def load_existing_proxies(filename):
 
 
 def compare_proxies(new_config, existing_config, print_proxies=False):
-    new_proxies = {json.dumps(proxy, sort_keys=True)
-                   for proxy in new_config["proxies"]}
-    existing_proxies = {
-        json.dumps(proxy, sort_keys=True) for proxy in existing_config["proxies"]
-    }
-
-    added_proxies = new_proxies - existing_proxies
-    np_message = (
-        "New proxies found:" if print_proxies else "Skipping printing new proxies..."
-    )
-    if added_proxies:
+    diff = diff_proxies(new_config["proxies"], existing_config["proxies"])
+    if any(diff.values()):
         print("New proxies found:")
         if print_proxies:
-            for proxy in added_proxies:
-                print(json.loads(proxy))
+            for proxy in diff["added"] + diff["changed"]:
+                print(proxy)
 
-        print(f"Total number of new proxies: {len(added_proxies)}")
+        print(
+            f"Total number of new proxies: {len(diff['added'])}, "
+            f"changed: {len(diff['changed'])}, removed: {len(diff['removed'])}")
         return True
 
     print("No update available\n")
@@ -203,61 +555,352 @@ def get_base_filename(url):
             "URL does not contain enough parts to extract base filename")
 
 
-def main():
-    urls = [
-        "https://raw.githubusercontent.com/barry-far/V2ray-Configs/main/Splitted-By-Protocol/vmess.txt",
-        "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_base64_Sub.txt",
-        "https://raw.githubusercontent.com/resasanian/Mirza/main/vmess",
-        "https://raw.githubusercontent.com/aiboboxx/v2rayfree/main/v2",
-    ]
+def save_latency_ranked(folder_name_base, clash_config, top_k):
+    # Probe the source's proxies and write them fastest first, plus a file
+    # with only the top_k fastest
+    import test_servers
 
-    for url in urls:
-        print(f"Processing {url}\n")
-        decoded_data = decode_v2ray_subscription(url)
-        if decoded_data is None:
-            continue
+    results = test_servers.check_proxies(clash_config["proxies"])
+    ranked_proxies = test_servers.rank_by_latency(results)
+    save_provider(f"{folder_name_base}/proxies_by_latency.yaml",
+                  {"proxies": ranked_proxies}, flow_style=True)
+    save_provider(f"{folder_name_base}/proxies_fastest.yaml",
+                  {"proxies": ranked_proxies[:top_k]}, flow_style=True)
+
+
+def process_subscription(url, decoded_data, convert_workers=1, rank_top=0, sinks=None):
+    clash_config = convert_v2ray_to_clash(decoded_data, convert_workers)
+
+    try:
+        folder_name_base = f"proxies/{get_base_filename(url)}"
+        directory = Path(folder_name_base)
+        if not directory.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+    except ValueError as e:
+        print(f"Skipping URL {url}: {e}")
+        return
 
-        clash_config = convert_v2ray_to_clash(decoded_data)
+    # Load existing proxies
+    existing_proxies = load_existing_proxies(
+        f"{folder_name_base}/proxies.yaml")
+
+    # Check for updates
+    if existing_proxies:
+        if not compare_proxies(clash_config, existing_proxies):
+            return clash_config["proxies"]
+
+    # Save all proxies, the port splits and their server-rewritten copies
+    with metrics.timer("yaml_dump"):
+        write_outputs(folder_name_base, clash_config["proxies"], sinks)
+
+    if rank_top:
+        save_latency_ranked(folder_name_base, clash_config, rank_top)
+
+    return clash_config["proxies"]
+
+
+def stream_subscription(
+    url,
+    session=None,
+    timeout=REQUEST_TIMEOUT,
+    cache_entry=None,
+    sinks=None,
+):
+    # Streaming variant of fetch + process_subscription: the body is decoded
+    # and converted while it downloads and every proxy goes straight to the
+    # output files, so memory stays flat regardless of subscription size.
+    # Returns the new HTTP cache entry.
+    import requests
+
+    folder_name_base = f"proxies/{get_base_filename(url)}"
+    Path(folder_name_base).mkdir(parents=True, exist_ok=True)
+
+    http = session if session is not None else requests
+    with http.get(
+        url,
+        headers=conditional_headers(cache_entry),
+        stream=True,
+        timeout=timeout,
+    ) as response:
+        if response.status_code == 304 and cache_entry:
+            metrics.count("sources_not_modified")
+            print("No update available\n")
+            return cache_entry
+        if response.status_code != 200:
+            raise Exception(
+                f"Failed to fetch V2Ray subscription from {url}. Status code: {response.status_code}"
+            )
 
+        digest = hashlib.sha256()
+
+        def chunks():
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                metrics.count("fetch_bytes", len(chunk))
+                digest.update(chunk)
+                yield chunk
+
+        stats = new_conversion_stats()
+        lines = iter_lines(iter_base64_decode(chunks()))
+        proxies = iter_clash_proxies(lines, stats)
+
+        # Download, decode, convert and write are interleaved here, so they
+        # are timed as a single stage
+        with metrics.timer("stream"):
+            converted = write_outputs(folder_name_base, proxies, sinks)
+        metrics.count("nodes_converted", converted)
+        print_conversion_stats(stats)
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": digest.hexdigest(),
+        }
+
+
+def stream_subscriptions(
+    urls,
+    max_workers=MAX_WORKERS,
+    per_host=PER_HOST_LIMIT,
+    timeout=REQUEST_TIMEOUT,
+    use_cache=True,
+    sinks=None,
+    session=None,
+):
+    def stream(url, session):
+        print(f"Processing {url}\n")
+        result = {"url": url, "error": None, "not_modified": False, "cache": None}
+        cache_entry = load_http_cache(url) if use_cache else None
         try:
-            folder_name_base = f"proxies/{get_base_filename(url)}"
-            directory = Path(folder_name_base)
-            if not directory.exists():
-                directory.mkdir(parents=True, exist_ok=True)
-        except ValueError as e:
-            print(f"Skipping URL {url}: {e}")
-            continue
-
-        # Load existing proxies
-        existing_proxies = load_existing_proxies(
-            f"{folder_name_base}/proxies.yaml")
-
-        # Check for updates
-        if existing_proxies:
-            if not compare_proxies(clash_config, existing_proxies):
-                continue
+            result["cache"] = stream_subscription(
+                url, session, timeout, cache_entry, sinks)
+        except Exception as e:
+            result["error"] = str(e)
+            return result
+        # A 304 hands back the old entry; an identical body has the same hash
+        result["not_modified"] = bool(cache_entry) and (
+            result["cache"] is cache_entry
+            or result["cache"]["sha256"] == cache_entry.get("sha256"))
+        return result
+
+    return map_subscriptions(stream, urls, max_workers, per_host, session)
+
+
+def load_source_proxies(url):
+    # Last written proxies of a source, for sources not converted this run
+    try:
+        existing = load_existing_proxies(
+            f"proxies/{get_base_filename(url)}/proxies.yaml")
+    except ValueError:
+        return []
+    return (existing or {}).get("proxies") or []
+
+
+def build_canonical(sources):
+    # Global dedupe across sources. sources is a list of (url, proxies);
+    # the first occurrence of each fingerprint is kept and every source that
+    # contained it is recorded. Returns (proxies, provenance) where
+    # provenance maps the final proxy name to its fingerprint and sources.
+    index = {}
+    provenance = {}
+    total = 0
+    for url, proxies in sources:
+        for proxy in proxies:
+            total += 1
+            fingerprint = proxy_fingerprint(proxy)
+            if fingerprint not in index:
+                index[fingerprint] = proxy
+                provenance[fingerprint] = []
+            if url not in provenance[fingerprint]:
+                provenance[fingerprint].append(url)
+
+    proxies = ensure_unique_names(index.values())
+    print(
+        f"Canonical provider: {len(proxies)} unique proxies out of {total} from {len(sources)} sources")
+    return proxies, {
+        proxy["name"]: {"fingerprint": fingerprint, "sources": provenance[fingerprint]}
+        for proxy, fingerprint in zip(proxies, index)
+    }
 
-        # Save all proxies
-        save_yaml(f"{folder_name_base}/proxies.yaml", clash_config)
 
-        # Filter and save proxies with port 80
-        proxies_port_80 = filter_proxies_by_port(clash_config, 80)
-        save_yaml(f"{folder_name_base}/proxies_port_80.yaml", proxies_port_80)
+def save_canonical(sources, canonical_dir=CANONICAL_DIR, sinks=None):
+    with metrics.timer("dedupe"):
+        proxies, provenance = build_canonical(sources)
+    metrics.count("canonical_proxies", len(proxies))
+    Path(canonical_dir).mkdir(parents=True, exist_ok=True)
+    with metrics.timer("yaml_dump"):
+        write_outputs(canonical_dir, proxies, sinks)
+    with atomic_write(f"{canonical_dir}/{PROVENANCE_FILE}") as file:
+        json.dump(provenance, file, ensure_ascii=False, indent=2)
+    print(f"Provenance has been written to {canonical_dir}/{PROVENANCE_FILE}")
+    with atomic_write(f"{canonical_dir}/{SINKS_FILE}") as file:
+        json.dump(sinks if sinks is not None else build_sinks(), file)
+    return proxies, provenance
+
+
+def canonical_is_current(canonical_dir, sinks=None):
+    # Whether the canonical files exist and were written with these sinks
+    if sinks is None:
+        sinks = build_sinks()
+    paths = [f"{canonical_dir}/{sink['file']}" for sink in sinks]
+    paths.append(f"{canonical_dir}/{PROVENANCE_FILE}")
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    try:
+        with open(f"{canonical_dir}/{SINKS_FILE}", "r") as file:
+            return json.load(file) == json.loads(json.dumps(sinks))
+    except (OSError, ValueError):
+        return False
+
+
+def load_canonical(canonical_dir=CANONICAL_DIR):
+    # The canonical (proxies, provenance) last written to canonical_dir, or
+    # None when there is none
+    proxies_path = f"{canonical_dir}/proxies.yaml"
+    provenance_path = f"{canonical_dir}/{PROVENANCE_FILE}"
+    if not os.path.exists(proxies_path) or not os.path.exists(provenance_path):
+        return None
+    data = parse_yaml(proxies_path) or {}
+    with open(provenance_path, "r") as file:
+        provenance = json.load(file)
+    return from_dicts(data.get("proxies") or []), provenance
 
-        # Filter and save proxies with port 443
-        proxies_port_443 = filter_proxies_by_port(clash_config, 443)
-        save_yaml(f"{folder_name_base}/proxies_port_443.yaml",
-                  proxies_port_443)
 
-        # Update server address and save
-        new_server = "104.26.6.171"  # Replace with the new server IP or hostname
-        updated_config_80 = update_server(proxies_port_80, new_server)
-        save_yaml(f"{folder_name_base}/proxies_updated_80.yaml",
-                  updated_config_80)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert vmess subscriptions to clash meta proxy providers"
+    )
+    parser.add_argument(
+        "urls", nargs="*", default=SUBSCRIPTION_URLS,
+        help="Subscription urls (defaults to the built-in list)")
+    parser.add_argument(
+        "--workers", type=int, default=MAX_WORKERS,
+        help="Number of subscriptions downloaded at the same time")
+    parser.add_argument(
+        "--per-host", type=int, default=PER_HOST_LIMIT,
+        help="Maximum simultaneous downloads from one host")
+    parser.add_argument(
+        "--timeout", type=float, default=REQUEST_TIMEOUT,
+        help="Per-request timeout in seconds")
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Ignore ETag/Last-Modified cache and always download in full")
+    parser.add_argument(
+        "--convert-workers", type=int, default=1,
+        help="Processes used to convert large subscriptions (0 = all CPUs)")
+    parser.add_argument(
+        "--rank-top", type=int, default=0, metavar="K",
+        help="Probe each source and also write proxies_by_latency.yaml and "
+        "proxies_fastest.yaml with its K fastest proxies")
+    parser.add_argument(
+        "--ports", type=int, nargs="+", default=OUTPUT_PORTS,
+        help="Ports that get their own proxies_port_<port>.yaml split")
+    parser.add_argument(
+        "--cdn-server", action="append", dest="cdn_servers",
+        help="Server address written into proxies_updated_<port>.yaml; "
+        "repeat for extra proxies_updated_<port>_<server>.yaml copies")
+    parser.add_argument(
+        "--front-cache", metavar="FILE",
+        help="Spread proxies_updated_<port>.yaml across the best fronts "
+        "ranked by front_scanner.py in FILE instead of one CDN server")
+    parser.add_argument(
+        "--fronts", type=int, default=FRONTS, metavar="N",
+        help="How many of the ranked fronts to use with --front-cache")
+    parser.add_argument(
+        "--canonical-dir", default=CANONICAL_DIR,
+        help="Where the provider deduplicated across all sources is written")
+    parser.add_argument(
+        "--no-canonical", action="store_true",
+        help="Skip the cross-source deduplicated provider")
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Decode, convert and write each subscription while it downloads")
+    metrics.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def cdn_servers(args):
+    # The scanned front pool leads when there is a fresh one, and any
+    # --cdn-server addresses still get their own copies
+    if not args.front_cache:
+        return args.cdn_servers
+    import front_scanner
+
+    fronts = front_scanner.load_fronts(args.front_cache, args.fronts)
+    if not fronts:
+        print(f"No usable fronts in {args.front_cache}, using the fixed CDN servers")
+        return args.cdn_servers
+    return [fronts] + (args.cdn_servers or [])
+
+
+def run(args, urls=None, session=None):
+    # One refresh: fetch and convert urls (default: every source in args),
+    # then rebuild the canonical provider from all of args.urls. The rebuild
+    # is skipped when no source changed and the canonical files are current.
+    # Returns the canonical (proxies, provenance), or None when that stage
+    # is disabled or was skipped.
+    urls = args.urls if urls is None else urls
+    sinks = build_sinks(args.ports, cdn_servers(args))
+    converted = {}
+    changed = False
+    if args.stream:
+        results = stream_subscriptions(
+            urls,
+            max_workers=args.workers,
+            per_host=args.per_host,
+            timeout=args.timeout,
+            use_cache=not args.no_cache,
+            sinks=sinks,
+            session=session,
+        )
+        for result in results:
+            if result["error"]:
+                metrics.count("sources_failed")
+                print(f"Failed to process {result['url']}: {result['error']}\n")
+            else:
+                changed = changed or not result["not_modified"]
+                save_http_cache(result["url"], result["cache"])
+    else:
+        results = fetch_subscriptions(
+            urls,
+            max_workers=args.workers,
+            per_host=args.per_host,
+            timeout=args.timeout,
+            use_cache=not args.no_cache,
+            session=session,
+        )
+
+        for result in results:
+            url = result["url"]
+            print(f"Processing {url}\n")
+            if result["error"]:
+                metrics.count("sources_failed")
+                print(f"Failed to fetch {url}: {result['error']}\n")
+                continue
+            if result["not_modified"]:
+                print("No update available\n")
+                continue
 
-        updated_config_443 = update_server(proxies_port_443, new_server)
-        save_yaml(f"{folder_name_base}/proxies_updated_443.yaml",
-                  updated_config_443)
+            converted[url] = process_subscription(
+                url, result["data"], args.convert_workers, args.rank_top, sinks)
+            save_http_cache(url, result["cache"])
+            changed = True
+
+    if not args.no_canonical:
+        if not changed and canonical_is_current(args.canonical_dir, sinks):
+            metrics.count("canonical_skipped")
+            print(f"No source changed, {args.canonical_dir} is up to date\n")
+            return None
+        sources = [
+            (url, converted[url] if converted.get(url) is not None else load_source_proxies(url))
+            for url in args.urls
+        ]
+        return save_canonical(sources, args.canonical_dir, sinks)
+    return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run(args)
+    metrics.write_reports(args)
 
 
 if __name__ == "__main__":
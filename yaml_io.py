@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import yaml
+
+import metrics
+from proxy_node import ProxyNode
+
+# libyaml bindings load several times faster; fall back to pure Python when
+# PyYAML was built without them
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class ProviderDumper(yaml.SafeDumper):
+    # Output stays on the pure Python emitter: libyaml escapes every
+    # character outside the BMP even with allow_unicode, which would turn
+    # the flag emoji in nearly every proxy name into \U0001F1FA sequences
+    pass
+
+
+# ProxyNode becomes a clash mapping only here, at serialisation time
+ProviderDumper.add_representer(
+    ProxyNode, lambda dumper, proxy: dumper.represent_dict(proxy.to_dict()))
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Parsed providers are cached in a sidecar file next to the YAML, keyed by
+# the YAML file's mtime and size, so unchanged files are never re-parsed
+SIDECAR_CACHE = True
+SIDECAR_SUFFIX = ".cache.msgpack" if msgpack else ".cache.json"
+
+# Keep flow-style entries on a single line (the C emitter needs an int)
+NO_WRAP = 2**31 - 1
+
+
+@contextmanager
+def atomic_write(file_path, mode="w"):
+    # Write to a temporary file in the same directory and rename it over
+    # file_path, so readers such as clash-meta never see a partial file
+    directory, name = os.path.split(file_path)
+    fd, temp_path = tempfile.mkstemp(dir=directory or ".", prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        try:
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def sidecar_path(file_path):
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}{SIDECAR_SUFFIX}")
+
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_sidecar(file_path, signature):
+    path = sidecar_path(file_path)
+    try:
+        if msgpack:
+            with open(path, "rb") as file:
+                cached = msgpack.unpackb(file.read(), raw=False)
+        else:
+            with open(path, "r") as file:
+                cached = json.load(file)
+    except (OSError, ValueError):
+        return False, None
+    if cached.get("signature") != signature:
+        return False, None
+    return True, cached.get("data")
+
+
+def write_sidecar(file_path, signature, data):
+    path = sidecar_path(file_path)
+    cached = {"signature": signature, "data": data}
+    try:
+        if msgpack:
+            with open(path, "wb") as file:
+                file.write(msgpack.packb(cached, use_bin_type=True))
+        else:
+            with open(path, "w") as file:
+                json.dump(cached, file, ensure_ascii=False)
+    except (OSError, TypeError, ValueError):
+        # Data that JSON/msgpack cannot hold (dates, odd keys) is not cached
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def parse_yaml(file_path, use_cache=SIDECAR_CACHE):
+    # Parse file_path, raising yaml.YAMLError or OSError on failure
+    if use_cache:
+        signature = file_signature(file_path)
+        hit, data = read_sidecar(file_path, signature)
+        if hit:
+            metrics.count("yaml_sidecar_hits")
+            return data
+
+    with metrics.timer("yaml_load"), open(file_path, "r") as file:
+        data = yaml.load(file, Loader=SafeLoader)
+
+    if use_cache:
+        write_sidecar(file_path, signature, data)
+    return data
+
+
+def load_yaml(file_path, use_cache=SIDECAR_CACHE):
+    try:
+        return parse_yaml(file_path, use_cache)
+    except yaml.YAMLError as e:
+        print(f"Error loading YAML file {file_path}: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Unexpected error loading file {file_path}: {e}")
+        sys.exit(1)
+
+
+def dump_yaml(data, file=None, flow_style=False, **kwargs):
+    # The provider layout used by every script: keys in insertion order,
+    # unicode names kept readable
+    options = {"indent": 2} if not flow_style else {}
+    options.update(kwargs)
+    return yaml.dump(
+        data,
+        file,
+        Dumper=ProviderDumper,
+        allow_unicode=True,
+        sort_keys=False,
+        default_flow_style=flow_style,
+        **options,
+    )
+
+
+def save_provider(file_path, data, flow_style=False):
+    # Atomically write a provider file; nothing is written when data holds
+    # no proxies
+    if not data or not data.get("proxies"):
+        print(f"No valid data to save to {file_path}")
+        return
+
+    try:
+        with metrics.timer("yaml_dump"), atomic_write(file_path) as file:
+            dump_yaml(data, file, flow_style=flow_style)
+        print(f"Configuration has been written to {file_path}")
+    except Exception as e:
+        print(f"Error saving YAML file {file_path}: {e}")
+        sys.exit(1)